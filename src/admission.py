@@ -0,0 +1,162 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable
+
+
+class Rejected(Exception):
+    '''
+    Job was not admitted, ``retry_after`` is the estimated wait in seconds
+    '''
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason, retry_after)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def __str__(self) -> str:
+        return f"Busy, retry in {math.ceil(self.retry_after)} s"
+
+
+class TokenBucket:
+    '''
+    ``rate`` tokens per second, at most ``burst`` tokens saved
+    '''
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        '''
+        Seconds until one token is available, 0 if it is now
+        '''
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class AdmissionControl:
+    '''
+    Admission control in front of prediction: per user and global
+    token buckets, bounded queue of pending jobs and round-robin
+    between users, so one heavy user can not starve the rest.
+    ``concurrency`` jobs run at the same time
+    '''
+
+    def __init__(self, user_rate: float, user_burst: float, global_rate: float, global_burst: float,
+                 queue_size: int, user_queue_size: int, concurrency: int) -> None:
+        (self.user_rate, self.user_burst) = (user_rate, user_burst)
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.queue_size = queue_size
+        self.user_queue_size = user_queue_size
+        self.concurrency = concurrency
+        self._buckets = dict()
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._job_time = 1.0
+        self._ready = threading.Condition()
+        self.stats = {
+            "accepted": 0,
+            "rejected_user_rate": 0,
+            "rejected_global_rate": 0,
+            "rejected_queue": 0,
+            "completed": 0
+        }
+        for index in range(concurrency):
+            threading.Thread(target=self._run, name=f"Admission-{index}", daemon=True).start()
+
+    def _reject(self, reason: str, retry_after: float) -> None:
+        self.stats[f"rejected_{reason}"] += 1
+        raise Rejected(reason, retry_after)
+
+    def submit(self, user_id: int, job: Callable, *args) -> Future:
+        '''
+        Queue ``job(*args)`` for the user or raise ``Rejected``
+        '''
+        now = time.monotonic()
+        with self._ready:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            user_queue = self._queues.get(user_id, ())
+            backlog = self._job_time * (self._queued + 1) / self.concurrency
+            if self._queued >= self.queue_size:
+                self._reject("queue", backlog)
+            if len(user_queue) >= self.user_queue_size:
+                self._reject("queue", self._job_time * len(user_queue))
+            wait = bucket.wait_time(now)
+            if wait:
+                self._reject("user_rate", wait)
+            wait = self.global_bucket.wait_time(now)
+            if wait:
+                self._reject("global_rate", wait)
+            bucket.take()
+            self.global_bucket.take()
+            # Idle users with full bucket do not need to be remembered
+            if len(self._buckets) > 10 * self.queue_size:
+                self._drop_full_buckets(now)
+            future = Future()
+            self._queues.setdefault(user_id, deque()).append((future, job, args))
+            self._queued += 1
+            self.stats["accepted"] += 1
+            self._ready.notify()
+        return future
+
+    def _drop_full_buckets(self, now: float) -> None:
+        for (user_id, bucket) in list(self._buckets.items()):
+            bucket._refill(now)
+            if bucket.tokens >= bucket.burst and user_id not in self._queues:
+                del self._buckets[user_id]
+
+    def _next_job(self) -> tuple:
+        '''
+        Job of the first user in round-robin order, he goes to the end
+        '''
+        with self._ready:
+            while not self._queued:
+                self._ready.wait()
+            (user_id, user_queue) = next(iter(self._queues.items()))
+            job = user_queue.popleft()
+            if user_queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._queued -= 1
+            return job
+
+    def _run(self) -> None:
+        while True:
+            (future, job, args) = self._next_job()
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.monotonic()
+            try:
+                future.set_result(job(*args))
+            except BaseException as error:
+                future.set_exception(error)
+            with self._ready:
+                # Moving average of job duration for retry estimates
+                self._job_time = 0.8 * self._job_time + 0.2 * (time.monotonic() - start)
+                self.stats["completed"] += 1
+
+    def get_stats(self) -> dict:
+        '''
+        Accepted, rejected, completed and currently queued jobs
+        '''
+        with self._ready:
+            stats = dict(self.stats)
+            stats["queued"] = self._queued
+            stats["users_waiting"] = len(self._queues)
+        return stats
@@ -0,0 +1,183 @@
+import asyncio
+import time
+
+from telebot import asyncio_helper, util
+from telebot.async_telebot import AsyncTeleBot
+
+from botconfig import *
+import bothandler
+from admission import Rejected
+from bothandler import (cached_reply, check_session, logout_reply, open_db,
+                        password_reply, predict_reply, register_reply,
+                        start_engine, start_metrics)
+from metrics import METRICS, instrumented
+from startup import REPORT
+
+'''
+Asyncio runtime with the same commands as bothandler.
+All chats share one pooled aiohttp session of ``asyncio_helper``.
+Session and database calls run in threads, a slow fsync of SQLite
+must not stall the event loop
+'''
+asyncio_helper.REQUEST_LIMIT = BOT_HTTP_POOL
+if BOT_API_URL:
+    asyncio_helper.API_URL = BOT_API_URL
+    asyncio_helper.FILE_URL = BOT_FILE_URL
+ABOT = AsyncTeleBot(TOKEN)
+# Next step handlers by (chat id, user id), like ``register_next_step_handler``
+NEXT_STEPS = dict()
+
+
+def register_next_step(message, handler) -> None:
+    NEXT_STEPS[(message.chat.id, message.from_user.id)] = handler
+
+
+def has_next_step(message) -> bool:
+    return (message.chat.id, message.from_user.id) in NEXT_STEPS
+
+
+@ABOT.message_handler(func=has_next_step, content_types=util.content_type_media)
+async def next_step(message) -> None:
+    '''
+    Pass message to the waiting step of the dialog
+    '''
+    handler = NEXT_STEPS.pop((message.chat.id, message.from_user.id))
+    await handler(message)
+
+
+@ABOT.message_handler(commands=['start', 'help'])
+@instrumented("help")
+async def send_usage(message) -> None:
+    '''
+    Basic trigger to /start and /help commands
+    '''
+    await ABOT.reply_to(message, text=INFO_MESSAGE)
+
+
+@ABOT.message_handler(commands=["register"])
+@instrumented("register")
+async def register_user(message) -> None:
+    '''
+    Sign up process to another user.
+    '''
+    await ABOT.reply_to(message, REGISTER_MESSAGE)
+    register_next_step(message, init_new_user)
+
+
+@ABOT.message_handler(commands=["login"])
+@instrumented("login")
+async def login_user(message) -> None:
+    '''
+    Login method. Update element in user's database.
+    '''
+    await ABOT.reply_to(message, LOGIN_MESSAGE)
+    register_next_step(message, check_passwd)
+
+
+@ABOT.message_handler(commands=['predict'])
+@instrumented("predict")
+async def image_processing(message) -> None:
+    '''
+    Predict object in sended through the message picture
+    '''
+    if await asyncio.to_thread(check_session, message):
+        start_engine()
+        await ABOT.reply_to(message, "Send me your image :>")
+        register_next_step(message, predict_init)
+    else:
+        await ABOT.reply_to(message, "Please, login first :<")
+
+
+@ABOT.message_handler(commands=['logout'])
+@instrumented("logout")
+async def logout(message) -> None:
+    '''
+    Logout process.
+    '''
+    await ABOT.reply_to(message, "Okey, have a nice day!")
+    reply = await asyncio.to_thread(logout_reply, message.from_user.id)
+    await ABOT.send_message(message.chat.id, reply)
+
+
+@instrumented("password")
+async def check_passwd(message) -> None:
+    '''
+    Password verification
+    '''
+    reply = await asyncio.to_thread(password_reply, message.from_user.id, message.text)
+    await ABOT.send_message(message.chat.id, reply)
+
+
+@instrumented("new_password")
+async def init_new_user(message) -> None:
+    '''
+    Help function to register process
+    '''
+    reply = await asyncio.to_thread(register_reply, message.from_user.id, message.text)
+    await ABOT.send_message(message.chat.id, reply)
+
+
+@instrumented("image")
+async def predict_init(message) -> None:
+    '''
+    Download object from chat and classify it in admission
+    control threads, so the event loop keeps serving other chats
+    '''
+    loop = asyncio.get_running_loop()
+    photo = message.photo[-1]
+    cached = await asyncio.to_thread(cached_reply, photo.file_unique_id)
+    if cached is not None:
+        await ABOT.send_message(message.chat.id, cached, parse_mode="Markdown")
+        return
+    try:
+        future = bothandler.ADMISSION.submit(
+            message.from_user.id, download_and_predict, photo.file_id, photo.file_unique_id, loop,
+            time.perf_counter())
+    except Rejected as error:
+        METRICS.inc("predict_rejected_total", reason=error.reason)
+        await ABOT.reply_to(message, str(error))
+        return
+    await ABOT.reply_to(message, "Please, wait...")
+    try:
+        predict_result = await asyncio.wrap_future(future)
+    except BaseException:
+        predict_result = "Something went wrong"
+    with METRICS.span("predict_stage_seconds", stage="send_message"):
+        await ABOT.send_message(message.chat.id, predict_result, parse_mode="Markdown")
+
+
+def download_and_predict(file_id: str, file_unique_id: str, loop: asyncio.AbstractEventLoop,
+                         submitted: float = None) -> str:
+    '''
+    Download through the shared session of the event loop, then classify
+    '''
+    if submitted is not None:
+        METRICS.observe("predict_stage_seconds", time.perf_counter() - submitted, stage="admission_queue")
+
+    async def download() -> bytes:
+        with METRICS.span("predict_stage_seconds", stage="get_file"):
+            file_info = await ABOT.get_file(file_id)
+        with METRICS.span("predict_stage_seconds", stage="download_file"):
+            return await ABOT.download_file(file_info.file_path)
+
+    return predict_reply(asyncio.run_coroutine_threadsafe(download(), loop).result(), file_unique_id)
+
+
+def main() -> None:
+    '''
+    Main function
+    '''
+    start_metrics()
+    open_db()
+    REPORT.mark("database opened")
+    if not INFERENCE_LAZY_START:
+        start_engine()
+        REPORT.mark("inference started")
+    print("Telegram Support Bot started in asyncio mode...")
+    if STARTUP_REPORT:
+        print(REPORT.format())
+    asyncio.run(ABOT.polling())
+
+
+if __name__ == "__main__":
+    main()
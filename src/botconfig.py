@@ -1,5 +1,6 @@
 import telebot
 import os
+from telebot import apihelper
 
 '''
 Base constatnts
@@ -15,5 +16,59 @@ Usage:
 REGISTER_MESSAGE = "Please enter your password to continue.."
 LOGIN_MESSAGE = "Please enter your password to auth.."
 BOT_FOLDER = "./tmp"
+USERS_DB_PATH = f"{BOT_FOLDER}/users.sqlite3"
+SESSION_CAPACITY = 100_000  # Logged in users kept in memory
+SESSION_IDLE_TIMEOUT = 3600  # Seconds of inactivity before logout
+SESSION_PERSIST = True  # Write sessions to user's database to survive restarts
 TOKEN = os.environ.get('BOT_TOKEN')
-BOT = telebot.TeleBot(TOKEN)
+# Local Bot API server or fake one for load tests, e.g. http://127.0.0.1:8081/bot{0}/{1}
+BOT_API_URL = os.environ.get('BOT_API_URL')
+BOT_FILE_URL = os.environ.get('BOT_FILE_URL')
+BOT_HTTP_POOL = 100  # Connections in shared HTTP pool of async runtime
+if BOT_API_URL:
+    apihelper.API_URL = BOT_API_URL
+    apihelper.FILE_URL = BOT_FILE_URL
+BOT_THREADS = 16  # Handler threads, so predictions from many users can share one batch
+
+
+class PollingBot(telebot.TeleBot):
+    '''
+    TeleBot which does not lose the message following one
+    consumed by next step handler in the same updates batch
+    '''
+
+    def _notify_next_handlers(self, new_messages):
+        remaining = list()
+        for message in new_messages:
+            handlers = self.next_step_backend.get_handlers(message.chat.id)
+            if not handlers:
+                remaining.append(message)
+                continue
+            for handler in handlers:
+                self._exec_task(handler["callback"], message, *handler["args"], **handler["kwargs"])
+        new_messages[:] = remaining
+
+
+BOT = PollingBot(TOKEN, num_threads=BOT_THREADS)
+INFERENCE_MAX_BATCH = 32  # Images in one model.predict call
+INFERENCE_MAX_WAIT = 0.05  # Seconds to wait for batch to fill up
+INFERENCE_QUEUE_SIZE = 256  # Pending images before submit blocks
+INFERENCE_BACKEND = "keras"  # keras, tflite-float16 or tflite-int8
+MODEL_ARCHITECTURE = "dense"  # See classification.ARCHITECTURES
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', os.cpu_count()))  # 0 disables /predict
+INFERENCE_TIMEOUT = 60  # Seconds to wait for prediction
+INFERENCE_HEALTH_INTERVAL = 5  # Seconds between worker health checks
+PREDICT_USER_RATE = 0.1  # Predictions per second for one user
+PREDICT_USER_BURST = 3  # Predictions one user can make at once
+PREDICT_GLOBAL_RATE = 20  # Predictions per second for all users
+PREDICT_GLOBAL_BURST = 50
+PREDICT_QUEUE_SIZE = 100  # Pending predictions before "busy" answer
+PREDICT_USER_QUEUE_SIZE = 2  # Pending predictions of one user
+PREDICT_CONCURRENCY = 2 * INFERENCE_MAX_BATCH  # Predictions sent to workers at once, enough to fill batches
+RESULT_CACHE_SIZE = 10_000  # Prediction results kept in memory
+RESULT_CACHE_PATH = f"{BOT_FOLDER}/results.sqlite3"  # None to keep results only in memory
+RESULT_CACHE_DISK_SIZE = 1_000_000  # Prediction results kept on disk
+INFERENCE_LAZY_START = False  # Spawn inference workers on the first /predict instead of startup
+STARTUP_REPORT = bool(os.environ.get('BOT_STARTUP_REPORT'))  # Print import time and memory report
+METRICS_PORT = int(os.environ.get('BOT_METRICS_PORT', 0))  # Local Prometheus /metrics endpoint, off unless set
+METRICS_LOG_PATH = os.environ.get('BOT_METRICS_LOG')  # JSON line per observation, None disables
@@ -1,40 +1,61 @@
+from startup import REPORT
+
 import hashlib
-import json
+import queue
+import sys
+import threading
+import time
 
+from admission import AdmissionControl, Rejected
 from botconfig import *
-from classification import ModelTrain
+from inference import ProcessInference
+from metrics import METRICS, instrumented
+from resultcache import ResultCache
+from sessions import SessionCache
+from userstore import UserStore
 
-USERS_DB = dict()
+# Opened in open_db()
+USERS_DB = None
+SESSIONS = None
+# Started in main() or on the first /predict, inference workers must not be spawned on import
+ENGINE = None
+ENGINE_LOCK = threading.Lock()
+ADMISSION = None
+RESULTS = None
+REPORT.mark("bothandler imported")
 
 
 def check_session(message) -> bool:
     '''
     Check if current user exists in database and he is sign in already.
     '''
-    try:
-        return USERS_DB[message.from_user.id][1]
-    except KeyError:
-        return False
+    return SESSIONS.check(message.from_user.id)
 
 
-def check_passwd(message) -> None:
+def password_reply(user_id: int, user_input: str) -> str:
     '''
-    Password verification
+    Password verification. Returns answer for the user
     '''
-    user_input = message.text
-    chat_id = message.chat.id
-    user_id = message.from_user.id
     try:
-        if USERS_DB[user_id][0] == hashlib.sha256(user_input.encode() + SALT.encode()).hexdigest():
-            USERS_DB[user_id][1] = 1
-            BOT.send_message(chat_id, "Access granted")
+        if USERS_DB.get(user_id)[0] == hashlib.sha256(user_input.encode() + SALT.encode()).hexdigest():
+            SESSIONS.login(user_id)
+            return "Access granted"
         else:
-            BOT.send_message(chat_id, "Access denied. Check your password")
+            return "Access denied. Check your password"
     except BaseException:
-        BOT.send_message(chat_id, "Something went wrong")
+        return "Something went wrong"
+
+
+@instrumented("password")
+def check_passwd(message) -> None:
+    '''
+    Password verification
+    '''
+    BOT.send_message(message.chat.id, password_reply(message.from_user.id, message.text))
 
 
 @BOT.message_handler(commands=['start', 'help'])
+@instrumented("help")
 def send_usage(message) -> None:
     '''
     Basic trigger to /start and /help commands
@@ -43,6 +64,7 @@ def send_usage(message) -> None:
 
 
 @BOT.message_handler(commands=["register"])
+@instrumented("register")
 def register_user(message) -> None:
     '''
     Sign up process to another user.
@@ -52,6 +74,7 @@ def register_user(message) -> None:
 
 
 @BOT.message_handler(commands=["login"])
+@instrumented("login")
 def login_user(message) -> None:
     '''
     Login method. Update element in user's database.
@@ -61,11 +84,13 @@ def login_user(message) -> None:
 
 
 @BOT.message_handler(commands=['predict'])
+@instrumented("predict")
 def image_processing(message) -> None:
     '''
     Predict object in sended through the message picture
     '''
     if check_session(message):
+        start_engine()
         BOT.reply_to(message, "Send me your image :>")
         BOT.register_next_step_handler(message, predict_init)
     else:
@@ -73,72 +98,199 @@ def image_processing(message) -> None:
 
 
 @BOT.message_handler(commands=['logout'])
+@instrumented("logout")
 def logout(message) -> None:
     '''
     Logout process.
     '''
     BOT.reply_to(message, "Okey, have a nice day!")
-    try:
-        USERS_DB[message.from_user.id][1] = 0
-        BOT.send_message(message.chat.id, "Logout successful..")
-    except KeyError:
-        BOT.send_message(message.chat.id, "Wait.. You're not out user :<")
+    BOT.send_message(message.chat.id, logout_reply(message.from_user.id))
 
 
+def logout_reply(user_id: int) -> str:
+    '''
+    Drop login status of the user. Returns answer for the user
+    '''
+    if USERS_DB.get(user_id) is None:
+        return "Wait.. You're not out user :<"
+    SESSIONS.logout(user_id)
+    return "Logout successful.."
+
+
+@instrumented("image")
 def predict_init(message) -> None:
     '''
     Download object from chat and send it to model
     '''
+    chat_id = message.chat.id
+    photo = message.photo[-1]
+    cached = cached_reply(photo.file_unique_id)
+    if cached is not None:
+        BOT.send_message(chat_id, cached, parse_mode="Markdown")
+        return
+    try:
+        future = ADMISSION.submit(message.from_user.id, download_and_predict,
+                                  photo.file_id, photo.file_unique_id, time.perf_counter())
+    except Rejected as error:
+        METRICS.inc("predict_rejected_total", reason=error.reason)
+        BOT.reply_to(message, str(error))
+        return
     BOT.reply_to(message, "Please, wait...")
-    fileId = message.photo[-1].file_id
-    file_info = BOT.get_file(fileId)
-    download_object = BOT.download_file(file_info.file_path)
-    with open(f"./tmp/{file_info.file_id}", "wb") as user_image:
-        user_image.write(download_object)
-    new_model_object = ModelTrain(image_path=f"./tmp/{file_info.file_id}")
-    predict_result = new_model_object.predict_image()
-    BOT.send_message(message.chat.id, predict_result, parse_mode="Markdown")
-    os.remove(f"./tmp/{file_info.file_id}")
+    # Answer from admission thread, so handler thread is free while job waits in queue
+    future.add_done_callback(lambda done: send_result(chat_id, done))
 
 
+def send_result(chat_id: int, done) -> None:
+    with METRICS.span("predict_stage_seconds", stage="send_message"):
+        BOT.send_message(chat_id, done.result() if done.exception() is None else "Something went wrong",
+                         parse_mode="Markdown")
+
+
+def download_and_predict(file_id: str, file_unique_id: str = None, submitted: float = None) -> str:
+    if submitted is not None:
+        METRICS.observe("predict_stage_seconds", time.perf_counter() - submitted, stage="admission_queue")
+    with METRICS.span("predict_stage_seconds", stage="get_file"):
+        file_info = BOT.get_file(file_id)
+    with METRICS.span("predict_stage_seconds", stage="download_file"):
+        data = BOT.download_file(file_info.file_path)
+    return predict_reply(data, file_unique_id)
+
+
+def cached_reply(file_unique_id: str) -> str | None:
+    '''
+    Result for already classified Telegram file, without download
+    '''
+    version = getattr(ENGINE, "model_version", None)
+    if version is None:
+        return None
+    with METRICS.span("predict_stage_seconds", stage="cache_lookup"):
+        return RESULTS.get(version, file_unique_id)
+
+
+def predict_reply(data: bytes, file_unique_id: str = None) -> str:
+    '''
+    Classify downloaded image in inference workers, unless the same
+    image was classified by the same model before. Returns answer for the user
+    '''
+    version = getattr(ENGINE, "model_version", None)
+    with METRICS.span("predict_stage_seconds", stage="hash"):
+        digest = hashlib.sha256(data).hexdigest()
+    if version is not None:
+        with METRICS.span("predict_stage_seconds", stage="cache_lookup"):
+            result = RESULTS.get(version, digest)
+        if result is not None:
+            RESULTS.put(version, result, file_unique_id)
+            return result
+    try:
+        with METRICS.span("predict_stage_seconds", stage="inference"):
+            result = ENGINE.predict(data, timeout=INFERENCE_TIMEOUT)
+    except (TimeoutError, queue.Full) as error:
+        METRICS.inc("predict_errors_total", error=type(error).__name__)
+        return "Model is busy now, try again later.."
+    except BaseException as error:
+        METRICS.inc("predict_errors_total", error=type(error).__name__)
+        return "Something went wrong"
+    # Version could change while image was in the queue
+    version = ENGINE.model_version
+    if version is not None:
+        RESULTS.put(version, result, digest, file_unique_id)
+    return result
+
+
+def register_reply(user_id: int, user_passwd: str) -> str:
+    '''
+    Create user if he does not exist yet. Returns answer for the user
+    '''
+    if USERS_DB.add(user_id, hashlib.sha256(user_passwd.encode() + SALT.encode()).hexdigest()):
+        return "Now you can login"
+    return "You are already have an account"
+
+
+@instrumented("new_password")
 def init_new_user(message) -> None:
     '''
     Help function to register process
     '''
-    user_passwd = message.text
-    chat_id = message.chat.id
-    user_id = message.from_user.id
-    try:
-        if USERS_DB[user_id]:
-            BOT.send_message(chat_id, "You are already have an account")
-    except KeyError:
-        USERS_DB.update(
-            {user_id: [hashlib.sha256(user_passwd.encode() + SALT.encode()).hexdigest(), 0]})
-        with open(f"{BOT_FOLDER}/user_db", "a") as f:
-            f.write(json.dumps(USERS_DB))
-        BOT.send_message(chat_id, "Now you can login")
+    BOT.send_message(message.chat.id, register_reply(message.from_user.id, message.text))
+
+
+def open_db() -> None:
+    '''
+    Open user's database and sessions cache, old JSON ``user_db``
+    is imported once
+    '''
+    global USERS_DB, SESSIONS
+    os.makedirs(BOT_FOLDER, exist_ok=True)
+    USERS_DB = UserStore(USERS_DB_PATH)
+    USERS_DB.import_legacy(f"{BOT_FOLDER}/user_db")
+    SESSIONS = SessionCache(store=USERS_DB if SESSION_PERSIST else None,
+                            capacity=SESSION_CAPACITY,
+                            idle_timeout=SESSION_IDLE_TIMEOUT)
+    METRICS.add_collector("sessions", SESSIONS.get_stats)
+
+
+def start_engine() -> None:
+    '''
+    Start admission control and inference workers once. Workers
+    load the ML stack in background, handler process never imports it
+    '''
+    global ENGINE, ADMISSION, RESULTS
+    with ENGINE_LOCK:
+        if RESULTS is None:
+            RESULTS = ResultCache(capacity=RESULT_CACHE_SIZE,
+                                  disk_path=RESULT_CACHE_PATH,
+                                  disk_capacity=RESULT_CACHE_DISK_SIZE)
+            METRICS.add_collector("result_cache", RESULTS.get_stats)
+        if ADMISSION is None:
+            ADMISSION = AdmissionControl(user_rate=PREDICT_USER_RATE,
+                                         user_burst=PREDICT_USER_BURST,
+                                         global_rate=PREDICT_GLOBAL_RATE,
+                                         global_burst=PREDICT_GLOBAL_BURST,
+                                         queue_size=PREDICT_QUEUE_SIZE,
+                                         user_queue_size=PREDICT_USER_QUEUE_SIZE,
+                                         concurrency=PREDICT_CONCURRENCY)
+            METRICS.add_collector("admission", ADMISSION.get_stats)
+        if ENGINE is not None or not INFERENCE_WORKERS:
+            return
+        ENGINE = ProcessInference(workers=INFERENCE_WORKERS,
+                                  max_batch=INFERENCE_MAX_BATCH,
+                                  max_wait=INFERENCE_MAX_WAIT,
+                                  queue_size=INFERENCE_QUEUE_SIZE,
+                                  backend=INFERENCE_BACKEND,
+                                  architecture=MODEL_ARCHITECTURE,
+                                  health_interval=INFERENCE_HEALTH_INTERVAL)
+        METRICS.add_collector("inference", ENGINE.get_stats)
 
 
-def read_db() -> dict:
+def start_metrics() -> None:
     '''
-    Try to read all values from file with user's database.
+    Metrics endpoint on localhost and optional JSON log of observations
     '''
-    database = {}
-    if os.path.exists(f"{BOT_FOLDER}/user_db"):
-        with open(f"{BOT_FOLDER}/user_db", 'r') as db:
-            try:
-                database = json.load(db)
-            except KeyError:
-                pass
-    return database
+    if METRICS_LOG_PATH:
+        METRICS.set_json_log(METRICS_LOG_PATH)
+    if METRICS_PORT:
+        try:
+            METRICS.serve(METRICS_PORT)
+        except OSError as error:
+            # Metrics are optional, the bot works without them
+            print(f"Metrics endpoint is not started on port {METRICS_PORT}: {error}", file=sys.stderr)
+            return
+        print(f"Metrics on http://127.0.0.1:{METRICS_PORT}/metrics")
 
 
 def main() -> None:
     '''
     Main function
     '''
-    USERS_DB = read_db()
+    start_metrics()
+    open_db()
+    REPORT.mark("database opened")
+    if not INFERENCE_LAZY_START:
+        start_engine()
+        REPORT.mark("inference started")
     print("Telegram Support Bot started...")
+    if STARTUP_REPORT:
+        print(REPORT.format())
     BOT.polling()
 
 
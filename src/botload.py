@@ -0,0 +1,185 @@
+import argparse as ap
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+'''
+Fake Telegram Bot API server and load test for bot runtimes.
+Every chat runs the same dialog, the next message is sent only
+after all replies to the previous one arrived
+'''
+DIALOG = [
+    ("/register", 1),
+    ("password", 1),
+    ("/login", 1),
+    ("password", 1),
+    ("/help", 1),
+    ("/logout", 2)
+]
+TOKEN = "123456:load-test"
+
+
+class FakeTelegram:
+    '''
+    Minimal Bot API: getUpdates with long polling, sendMessage,
+    getFile and file downloads. ``latency`` is added to every call
+    '''
+
+    def __init__(self, chats: int, latency: float) -> None:
+        self.chats = chats
+        self.latency = latency
+        self.updates = list()
+        self.new_updates = asyncio.Condition()
+        self.steps = {chat_id: 0 for chat_id in range(1, chats + 1)}
+        self.replies = {chat_id: 0 for chat_id in range(1, chats + 1)}
+        self.finished = asyncio.Event()
+        self.polling = asyncio.Event()
+        self.done_chats = 0
+        self.started = None
+        self.message_id = 0
+
+    async def _params(self, request: web.Request) -> dict:
+        # Async client sends form body even with GET
+        params = dict(request.query)
+        params.update(await request.clone(method="POST").post())
+        return params
+
+    def _message(self, chat_id: int, text: str) -> dict:
+        self.message_id += 1
+        return {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text
+        }
+
+    async def _push(self, chat_id: int) -> None:
+        (text, expected) = DIALOG[self.steps[chat_id]]
+        message = self._message(chat_id, text)
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        async with self.new_updates:
+            self.updates.append({"update_id": len(self.updates) + 1, "message": message})
+            self.new_updates.notify_all()
+
+    async def start_dialogs(self) -> None:
+        self.started = time.perf_counter()
+        for chat_id in self.steps:
+            await self._push(chat_id)
+
+    async def get_updates(self, request: web.Request) -> web.Response:
+        params = await self._params(request)
+        self.polling.set()
+        offset = int(params.get("offset", 0) or 0)
+        timeout = float(params.get("timeout", 0) or 0)
+        async with self.new_updates:
+            if len(self.updates) < offset:
+                try:
+                    await asyncio.wait_for(
+                        self.new_updates.wait_for(lambda: len(self.updates) >= offset), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            result = self.updates[max(0, offset - 1):][:100]
+        return web.json_response({"ok": True, "result": result})
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        params = await self._params(request)
+        await asyncio.sleep(self.latency)
+        chat_id = int(params["chat_id"])
+        self.replies[chat_id] += 1
+        if self.steps[chat_id] < len(DIALOG) and self.replies[chat_id] >= DIALOG[self.steps[chat_id]][1]:
+            self.replies[chat_id] = 0
+            self.steps[chat_id] += 1
+            if self.steps[chat_id] < len(DIALOG):
+                # User answers after the reply was delivered and next step handler registered
+                asyncio.get_running_loop().call_later(
+                    self.latency, lambda: asyncio.ensure_future(self._push(chat_id)))
+            else:
+                self.done_chats += 1
+                if self.done_chats == self.chats:
+                    self.finished.set()
+        return web.json_response({"ok": True, "result": self._message(chat_id, params.get("text", ""))})
+
+    async def get_file(self, request: web.Request) -> web.Response:
+        params = await self._params(request)
+        await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": {
+            "file_id": params["file_id"], "file_unique_id": params["file_id"],
+            "file_path": f"photos/{params['file_id']}.jpg"}})
+
+    async def get_me(self, request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "result": {
+            "id": 123456, "is_bot": True, "first_name": "PythonLabs", "username": "pythonlabs_bot"}})
+
+    async def other(self, request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "result": True})
+
+    async def download(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        return web.Response(body=b"\xff\xd8\xff\xd9")
+
+    def app(self) -> web.Application:
+        application = web.Application()
+        application.router.add_route("*", "/bot{token}/getUpdates", self.get_updates)
+        application.router.add_route("*", "/bot{token}/sendMessage", self.send_message)
+        application.router.add_route("*", "/bot{token}/getFile", self.get_file)
+        application.router.add_route("*", "/bot{token}/getMe", self.get_me)
+        application.router.add_route("*", "/file/bot{token}/{path:.+}", self.download)
+        application.router.add_route("*", "/bot{token}/{method}", self.other)
+        return application
+
+
+async def run_load(runtime: str, chats: int, latency: float, port: int) -> float:
+    '''
+    Start fake API and bot runtime in subprocess, return dialogs per second
+    '''
+    server = FakeTelegram(chats, latency)
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    env = dict(os.environ,
+               BOT_TOKEN=TOKEN,
+               BOT_API_URL=f"http://127.0.0.1:{port}/bot{{0}}/{{1}}",
+               BOT_FILE_URL=f"http://127.0.0.1:{port}/file/bot{{0}}/{{1}}",
+               INFERENCE_WORKERS="0")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{runtime}.py")
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "tmp"))
+        process = subprocess.Popen([sys.executable, script], cwd=workdir, env=env,
+                                   stdout=subprocess.DEVNULL)
+        try:
+            while not server.polling.is_set():
+                if process.poll() is not None:
+                    raise RuntimeError(f"{runtime} exited with code {process.returncode}")
+                await asyncio.sleep(0.1)
+            await server.start_dialogs()
+            await server.finished.wait()
+            elapsed = time.perf_counter() - server.started
+        finally:
+            process.terminate()
+            process.wait()
+    await runner.cleanup()
+    return chats / elapsed
+
+
+def main():
+    parser = ap.ArgumentParser(prog="BotLoad",
+                               description="Compare polling and asyncio bot runtimes on fake Telegram API")
+    parser.add_argument("--chats", type=int, help="Concurrent chats", default=200)
+    parser.add_argument("--latency", type=float, help="Seconds added to every API call", default=0.05)
+    parser.add_argument("--port", type=int, help="Fake API port", default=8081)
+    args = parser.parse_args()
+
+    for runtime in ("bothandler", "asynchandler"):
+        rate = asyncio.run(run_load(runtime, args.chats, args.latency, args.port))
+        print(f"{runtime:13} {rate:.1f} dialogs/s ({rate * sum(n for (_, n) in DIALOG):.1f} replies/s)")
+
+
+if __name__ == "__main__":
+    main()
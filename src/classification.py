@@ -1,23 +1,129 @@
-from typing import Any
+import argparse as ap
+import hashlib
+import io
+import json
+import os
+import shutil
+import time
+from typing import Any, BinaryIO
 
-import matplotlib.pyplot as plt
 import numpy as np
 import tensorflow as tf
 from keras.preprocessing.image import DirectoryIterator, ImageDataGenerator
-from keras.utils import img_to_array, load_img
+from PIL import Image
+
+'''
+Training hyperparameters. Any change here produces a new model version
+'''
+HYPERPARAMS = {
+    "classes": ['human', 'shark'],
+    "target_size": (200, 200),
+    "train_batch_size": 190,
+    "valid_batch_size": 15,
+    "steps_per_epoch": 15,
+    "epochs": 15,
+    "validation_steps": 15
+}
+MODEL_DIR = "./models"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+SHARD_SIZE = 256
+BACKENDS = ("keras", "tflite-float16", "tflite-int8")
+CALIBRATION_SAMPLES = 100
+# Resize of every pipeline, the same as ``load_img`` and ``decode_image``
+RESIZE_METHOD = "nearest"
+
+# Loaded models by version, kept warm for the whole process
+_MODEL_CACHE = dict()
+# Computed versions by dataset directories
+_VERSIONS = dict()
+# TFLite interpreters by model file
+_INTERPRETERS = dict()
+# Model builders by architecture name
+ARCHITECTURES = dict()
+LATENCY_BATCH_SIZES = (1, 8, 32)
+
+
+def register_architecture(name: str):
+    '''
+    Decorator to add model builder to ``ARCHITECTURES``
+    '''
+    def wrapper(builder):
+        ARCHITECTURES[name] = builder
+        return builder
+    return wrapper
+
+
+@register_architecture("dense")
+def dense_model(input_shape: tuple) -> tf.keras.Model:
+    '''
+    Original Flatten + Dense model
+    '''
+    return tf.keras.models.Sequential([
+        tf.keras.layers.Flatten(input_shape=input_shape),
+        tf.keras.layers.Dense(128, activation=tf.nn.relu),
+        tf.keras.layers.Dense(1, activation=tf.nn.sigmoid)
+    ])
+
+
+@register_architecture("cnn")
+def cnn_model(input_shape: tuple) -> tf.keras.Model:
+    '''
+    Small conv/pooling network with global average pooling
+    '''
+    return tf.keras.models.Sequential([
+        tf.keras.layers.Conv2D(16, 3, activation=tf.nn.relu, input_shape=input_shape),
+        tf.keras.layers.MaxPooling2D(2),
+        tf.keras.layers.Conv2D(32, 3, activation=tf.nn.relu),
+        tf.keras.layers.MaxPooling2D(2),
+        tf.keras.layers.Conv2D(64, 3, activation=tf.nn.relu),
+        tf.keras.layers.MaxPooling2D(2),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(1, activation=tf.nn.sigmoid)
+    ])
+
+
+@register_architecture("separable")
+def separable_model(input_shape: tuple) -> tf.keras.Model:
+    '''
+    Depthwise-separable blocks with global average pooling
+    '''
+    return tf.keras.models.Sequential([
+        tf.keras.layers.Conv2D(16, 3, strides=2, activation=tf.nn.relu, input_shape=input_shape),
+        tf.keras.layers.SeparableConv2D(32, 3, activation=tf.nn.relu),
+        tf.keras.layers.MaxPooling2D(2),
+        tf.keras.layers.SeparableConv2D(64, 3, activation=tf.nn.relu),
+        tf.keras.layers.MaxPooling2D(2),
+        tf.keras.layers.SeparableConv2D(128, 3, activation=tf.nn.relu),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(1, activation=tf.nn.sigmoid)
+    ])
+
+
+class ModelNotTrainedError(FileNotFoundError):
+    '''
+    No saved artifact for current data and hyperparameters
+    '''
 
 
 class ModelTrain:
     '''
     Class to train Sequential prediction model
     '''
-    def __init__(self, image_path: str) -> None:
+    def __init__(self, image_path: str = None) -> None:
         '''
         Init method with dir names
         '''
         self.IMAGE_PATH = image_path
         self.TRAIN_DIR = "./data/train"
         self.VALID_DIR = "./data/valid"
+        self.MODEL_DIR = MODEL_DIR
+        self.PIPELINE = "generator"
+        self.BACKEND = "keras"
+        self.ARCHITECTURE = "dense"
+        # Threads of TFLite interpreters, inference workers split the cores
+        self.THREADS = os.cpu_count()
+        # Inference workers only load, training there would run in every process at once
+        self.TRAIN_MISSING = True
 
     def _create_generator(self) -> tuple[DirectoryIterator]:
         '''
@@ -28,31 +134,137 @@ class ModelTrain:
 
         train_generator = train_datagen.flow_from_directory(
             self.TRAIN_DIR,
-            classes=['human', 'shark'],
-            target_size=(200, 200),
-            batch_size=190,
+            classes=HYPERPARAMS['classes'],
+            target_size=HYPERPARAMS['target_size'],
+            batch_size=HYPERPARAMS['train_batch_size'],
             class_mode='binary')
 
         validation_generator = validation_datagen.flow_from_directory(
             self.VALID_DIR,
-            classes=['human', 'shark'],
-            target_size=(200, 200),
-            batch_size=15,
+            classes=HYPERPARAMS['classes'],
+            target_size=HYPERPARAMS['target_size'],
+            batch_size=HYPERPARAMS['valid_batch_size'],
             class_mode='binary',
             shuffle=False)
 
         return (train_generator, validation_generator)
 
+    def _list_images(self, directory: str) -> tuple[list, list]:
+        '''
+        Image paths with binary labels in ``classes`` order,
+        the same ones ``flow_from_directory`` gives
+        '''
+        paths, labels = list(), list()
+        for label, class_name in enumerate(HYPERPARAMS['classes']):
+            class_dir = os.path.join(directory, class_name)
+            for root, dirs, files in os.walk(class_dir):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        paths.append(os.path.join(root, name))
+                        labels.append(float(label))
+        return (paths, labels)
+
+    def _decode_image(self, path: tf.Tensor, label: tf.Tensor) -> tuple[tf.Tensor, tf.Tensor]:
+        '''
+        Read and resize one image to uint8 tensor
+        '''
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3,
+                                   expand_animations=False)
+        image = tf.image.resize(image, HYPERPARAMS['target_size'], method=RESIZE_METHOD)
+        return (tf.cast(image, tf.uint8), label)
+
+    def _shards_dir(self, directory: str) -> str:
+        return os.path.join(self.MODEL_DIR, "shards", self.preprocessing_version(),
+                            os.path.basename(os.path.normpath(directory)))
+
+    def export_shards(self, directory: str) -> str:
+        '''
+        Precompute resized images of ``directory`` into ``.npy`` shards
+        (uint8 images and float labels), so training skips decoding.
+        Shards are written aside and moved in at once, so an interrupted
+        export is never taken for a complete one
+        '''
+        out_dir = self._shards_dir(directory)
+        tmp_dir = f"{out_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            (paths, labels) = self._list_images(directory)
+            dataset = tf.data.Dataset.from_tensor_slices((paths, labels)).map(
+                self._decode_image, num_parallel_calls=tf.data.AUTOTUNE).batch(SHARD_SIZE)
+            for index, (images, shard_labels) in enumerate(dataset.as_numpy_iterator()):
+                np.save(os.path.join(tmp_dir, f"images_{index:05d}.npy"), images)
+                np.save(os.path.join(tmp_dir, f"labels_{index:05d}.npy"), shard_labels)
+            try:
+                os.replace(tmp_dir, out_dir)
+            except OSError:
+                # Another process has exported the same shards first
+                if not os.path.isdir(out_dir):
+                    raise
+                shutil.rmtree(tmp_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return out_dir
+
+    def _load_shards(self, directory: str) -> tf.data.Dataset:
+        '''
+        Dataset over memory-mapped shards, exported on the first use
+        '''
+        shards_dir = self._shards_dir(directory)
+        if not os.path.exists(shards_dir):
+            self.export_shards(directory)
+        names = sorted(name for name in os.listdir(shards_dir) if name.startswith("images_"))
+
+        def read_shards():
+            for name in names:
+                images = np.load(os.path.join(shards_dir, name), mmap_mode='r')
+                labels = np.load(os.path.join(shards_dir, name.replace("images_", "labels_")))
+                for index in range(len(labels)):
+                    yield (images[index], labels[index])
+
+        return tf.data.Dataset.from_generator(read_shards, output_signature=(
+            tf.TensorSpec(shape=(*HYPERPARAMS['target_size'], 3), dtype=tf.uint8),
+            tf.TensorSpec(shape=(), dtype=tf.float32)))
+
+    def _create_dataset(self, directory: str, batch_size: int, shuffle: bool) -> tf.data.Dataset:
+        '''
+        tf.data pipeline: parallel decode, cache of resized images,
+        shuffle buffer and prefetch. ``shards`` pipeline reads precomputed shards
+        '''
+        if self.PIPELINE == "shards":
+            dataset = self._load_shards(directory)
+        else:
+            (paths, labels) = self._list_images(directory)
+            dataset = tf.data.Dataset.from_tensor_slices((paths, labels)).map(
+                self._decode_image, num_parallel_calls=tf.data.AUTOTUNE)
+            cache_dir = os.path.join(self.MODEL_DIR, "cache")
+            os.makedirs(cache_dir, exist_ok=True)
+            dataset = dataset.cache(os.path.join(
+                cache_dir, f"{os.path.basename(os.path.normpath(directory))}_{self.preprocessing_version()}"))
+        if shuffle:
+            dataset = dataset.shuffle(buffer_size=1024, reshuffle_each_iteration=True)
+        dataset = dataset.map(lambda image, label: (tf.cast(image, tf.float32) / 255., label),
+                              num_parallel_calls=tf.data.AUTOTUNE)
+        # Repeat like DirectoryIterator does, so steps_per_epoch means the same
+        return dataset.repeat().batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    def _create_pipeline(self) -> tuple:
+        '''
+        Train and validation inputs for selected ``PIPELINE``
+        '''
+        if self.PIPELINE == "generator":
+            return self._create_generator()
+        return (self._create_dataset(self.TRAIN_DIR, HYPERPARAMS['train_batch_size'], shuffle=True),
+                self._create_dataset(self.VALID_DIR, HYPERPARAMS['valid_batch_size'], shuffle=False))
+
     def _model_compile(self) -> tuple[tf.keras.models.Sequential, Any]:
         '''
         Compile trained model
         '''
-        (train_generator, validation_generator) = self._create_generator()
-        model = tf.keras.models.Sequential([
-            tf.keras.layers.Flatten(input_shape=(200, 200, 3)),
-            tf.keras.layers.Dense(128, activation=tf.nn.relu),
-            tf.keras.layers.Dense(1, activation=tf.nn.sigmoid)
-        ])
+        (train_generator, validation_generator) = self._create_pipeline()
+        model = ARCHITECTURES[self.ARCHITECTURE]((*HYPERPARAMS['target_size'], 3))
 
         model.summary()
         model.compile(optimizer=tf.keras.optimizers.Adam(),
@@ -60,28 +272,340 @@ class ModelTrain:
                       metrics=['accuracy'])
 
         history = model.fit(train_generator,
-                            steps_per_epoch=15,
-                            epochs=15,
+                            steps_per_epoch=HYPERPARAMS['steps_per_epoch'],
+                            epochs=HYPERPARAMS['epochs'],
                             verbose=1,
                             validation_data=validation_generator,
-                            validation_steps=15)
+                            validation_steps=HYPERPARAMS['validation_steps'])
         return (model, history)
 
-    def predict_image(self) -> str:
+    def data_version(self) -> str:
         '''
-        Send object to analyse.
+        Hash of the dataset directories (file names, sizes and modification times)
+        '''
+        digest = hashlib.sha256()
+        for directory in (self.TRAIN_DIR, self.VALID_DIR):
+            for root, dirs, files in os.walk(directory):
+                dirs.sort()
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    digest.update(os.path.relpath(path, directory).encode())
+                    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()[:16]
+
+    def preprocessing_version(self) -> str:
+        '''
+        Hash of dataset and everything that shapes resized images: classes,
+        image size and resize method. Shards and dataset caches are keyed on it
+        '''
+        digest = hashlib.sha256()
+        digest.update(self.data_version().encode())
+        digest.update(json.dumps({"classes": HYPERPARAMS['classes'],
+                                  "target_size": HYPERPARAMS['target_size'],
+                                  "resize": RESIZE_METHOD}, sort_keys=True).encode())
+        return digest.hexdigest()[:16]
+
+    def model_version(self) -> str:
+        '''
+        Version of the model: hash of dataset, hyperparameters and architecture
+        '''
+        digest = hashlib.sha256()
+        digest.update(self.data_version().encode())
+        digest.update(json.dumps(HYPERPARAMS, sort_keys=True).encode())
+        digest.update(self.ARCHITECTURE.encode())
+        return digest.hexdigest()[:16]
+
+    def _artifact_path(self, version: str) -> str:
+        return os.path.join(self.MODEL_DIR, version)
+
+    def train(self, force: bool = False) -> str:
         '''
+        Train the model and save it as versioned artifact with
+        recorded training accuracy. Returns artifact version
+        '''
+        version = self.model_version()
+        artifact = self._artifact_path(version)
+        if not force and os.path.exists(os.path.join(artifact, "meta.json")):
+            return version
         (model, history) = self._model_compile()
-        img = load_img(self.IMAGE_PATH, target_size=(200, 200))
-        x = img_to_array(img)
-        plt.imshow(x / 255.)
-        x = np.expand_dims(x, axis=0)
-        images = np.vstack([x])
-        classes = model.predict(images, batch_size=19)
+        acc_res = history.history['accuracy']
+        os.makedirs(artifact, exist_ok=True)
+        # Own temporary files, so concurrent trainings never write into one file
+        model.save(os.path.join(artifact, f"model.{os.getpid()}.h5"))
+        os.replace(os.path.join(artifact, f"model.{os.getpid()}.h5"),
+                   os.path.join(artifact, "model.h5"))
+        meta = {
+            "version": version,
+            "accuracy": sum(acc_res) / len(acc_res),
+            "architecture": self.ARCHITECTURE,
+            "hyperparams": HYPERPARAMS
+        }
+        # meta.json is written last, so its presence marks a complete artifact
+        with open(os.path.join(artifact, f"meta.json.{os.getpid()}.tmp"), "w") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(artifact, f"meta.json.{os.getpid()}.tmp"),
+                   os.path.join(artifact, "meta.json"))
+        _MODEL_CACHE.pop(version, None)
+        return version
+
+    def load_model(self, refresh: bool = False) -> tuple[tf.keras.models.Sequential, dict]:
+        '''
+        Load current model version once per process.
+        Train it first if there is no saved artifact yet, unless
+        ``TRAIN_MISSING`` is off: then ``ModelNotTrainedError`` is raised.
+        ``refresh`` rehashes dataset to pick up changed data
+        '''
+        dirs = (self.TRAIN_DIR, self.VALID_DIR, self.MODEL_DIR, self.ARCHITECTURE)
+        if refresh or dirs not in _VERSIONS:
+            _VERSIONS[dirs] = self.model_version()
+        version = _VERSIONS[dirs]
+        if version not in _MODEL_CACHE:
+            artifact = self._artifact_path(self.train() if self.TRAIN_MISSING else version)
+            if not os.path.exists(os.path.join(artifact, "meta.json")):
+                raise ModelNotTrainedError(f"No trained model {version} in {self.MODEL_DIR}, "
+                                           f"run classification.py first")
+            model = tf.keras.models.load_model(
+                os.path.join(artifact, "model.h5"))
+            with open(os.path.join(artifact, "meta.json"), "r") as f:
+                meta = json.load(f)
+            _MODEL_CACHE.clear()
+            _MODEL_CACHE[version] = (model, meta)
+        return _MODEL_CACHE[version]
+
+    def decode_image(self, data: bytes | BinaryIO, out: np.ndarray = None) -> np.ndarray:
+        '''
+        Decode raw image bytes or buffer straight to model input array.
+        Resizing is the same as in ``load_img``, scaling is the same
+        ``1/255`` as in training. ``out`` is optional preallocated
+        float32 array of input shape
+        '''
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = io.BytesIO(data)
+        (height, width) = HYPERPARAMS['target_size']
+        with Image.open(data) as img:
+            img = img.convert('RGB').resize((width, height), Image.Resampling.NEAREST)
+            if out is None:
+                out = np.empty((height, width, 3), dtype=np.float32)
+            out[...] = np.asarray(img)
+        out *= 1/255
+        return out
+
+    def load_image(self) -> np.ndarray:
+        '''
+        Read ``IMAGE_PATH`` to model input array
+        '''
+        with open(self.IMAGE_PATH, "rb") as f:
+            return self.decode_image(f)
+
+    def predict_bytes(self, data: bytes | BinaryIO) -> str:
+        '''
+        Classify image from memory without touching the disk
+        '''
+        x = np.expand_dims(self.decode_image(data), axis=0)
+        return self.format_prediction(self.predict_batch(x)[0])
+
+    def _tflite_path(self, quantization: str) -> str:
+        (model, meta) = self.load_model()
+        return os.path.join(self._artifact_path(meta['version']), f"model_{quantization}.tflite")
+
+    def _representative_dataset(self):
+        '''
+        Calibration sample from validation set for int8 quantization
+        '''
+        (paths, labels) = self._list_images(self.VALID_DIR)
+        step = max(1, len(paths) // CALIBRATION_SAMPLES)
+        for path in paths[::step][:CALIBRATION_SAMPLES]:
+            with open(path, "rb") as f:
+                yield [np.expand_dims(self.decode_image(f), axis=0)]
+
+    def export_tflite(self, quantization: str = "int8") -> str:
+        '''
+        Convert current model to TFLite flatbuffer with post-training
+        ``int8`` (calibrated on validation images) or ``float16`` quantization
+        '''
+        (model, meta) = self.load_model()
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        match quantization:
+            case "float16":
+                converter.target_spec.supported_types = [tf.float16]
+            case "int8":
+                converter.representative_dataset = self._representative_dataset
+            case _:
+                raise ValueError(f"Unknown quantization {quantization}")
+        path = self._tflite_path(quantization)
+        with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+            f.write(converter.convert())
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+        _INTERPRETERS.pop(path, None)
+        return path
+
+    def _load_interpreter(self) -> tf.lite.Interpreter:
+        '''
+        TFLite interpreter for ``BACKEND``, exported on the first use
+        '''
+        path = self._tflite_path(self.BACKEND.split("-")[1])
+        if path not in _INTERPRETERS:
+            if not os.path.exists(path):
+                self.export_tflite(self.BACKEND.split("-")[1])
+            interpreter = tf.lite.Interpreter(model_path=path, num_threads=self.THREADS)
+            interpreter.allocate_tensors()
+            _INTERPRETERS[path] = interpreter
+        return _INTERPRETERS[path]
+
+    def predict_batch(self, images: np.ndarray) -> np.ndarray:
+        '''
+        Run model over stacked images in one vectorized call
+        with selected ``BACKEND``
+        '''
+        if self.BACKEND == "keras":
+            (model, meta) = self.load_model()
+            return model.predict(images, batch_size=len(images), verbose=0)[:, 0]
+        interpreter = self._load_interpreter()
+        input_details = interpreter.get_input_details()[0]
+        if tuple(input_details['shape']) != images.shape:
+            interpreter.resize_tensor_input(input_details['index'], images.shape)
+            interpreter.allocate_tensors()
+        interpreter.set_tensor(input_details['index'], images.astype(np.float32, copy=False))
+        interpreter.invoke()
+        return interpreter.get_tensor(interpreter.get_output_details()[0]['index'])[:, 0].copy()
+
+    def evaluate(self, batch_size: int = 32) -> float:
+        '''
+        Accuracy of ``BACKEND`` on validation set
+        '''
+        (paths, labels) = self._list_images(self.VALID_DIR)
+        correct = 0
+        images = np.empty((batch_size, *HYPERPARAMS['target_size'], 3), dtype=np.float32)
+        for start in range(0, len(paths), batch_size):
+            chunk = paths[start:start + batch_size]
+            for (index, path) in enumerate(chunk):
+                with open(path, "rb") as f:
+                    self.decode_image(f, out=images[index])
+            scores = self.predict_batch(images[:len(chunk)])
+            correct += int(np.sum((scores >= 0.5) == np.array(labels[start:start + batch_size], dtype=bool)))
+        return correct / len(paths)
+
+    def compare_backends(self) -> dict:
+        '''
+        Validation accuracy, model size and single image latency of every backend
+        '''
+        backend = self.BACKEND
+        (model, meta) = self.load_model()
+        image = np.zeros((1, *HYPERPARAMS['target_size'], 3), dtype=np.float32)
+        report = dict()
+        for name in BACKENDS:
+            self.BACKEND = name
+            if name == "keras":
+                path = os.path.join(self._artifact_path(meta['version']), "model.h5")
+            else:
+                self._load_interpreter()
+                path = self._tflite_path(name.split("-")[1])
+            self.predict_batch(image)
+            start = time.perf_counter()
+            for _ in range(20):
+                self.predict_batch(image)
+            report[name] = {
+                "accuracy": self.evaluate(),
+                "size": os.path.getsize(path),
+                "latency": (time.perf_counter() - start) / 20
+            }
+        self.BACKEND = backend
+        for name in BACKENDS:
+            report[name]["accuracy_diff"] = report[name]["accuracy"] - report["keras"]["accuracy"]
+        return report
+
+    def compare_architectures(self, names: list = None) -> dict:
+        '''
+        Train every registered architecture and report parameter count,
+        model file size, per image latency by batch size and validation accuracy
+        '''
+        (architecture, backend) = (self.ARCHITECTURE, self.BACKEND)
+        self.BACKEND = "keras"
+        report = dict()
+        for name in names or ARCHITECTURES:
+            self.ARCHITECTURE = name
+            (model, meta) = self.load_model()
+            latency = dict()
+            for batch_size in LATENCY_BATCH_SIZES:
+                images = np.zeros((batch_size, *HYPERPARAMS['target_size'], 3), dtype=np.float32)
+                self.predict_batch(images)
+                start = time.perf_counter()
+                for _ in range(10):
+                    self.predict_batch(images)
+                latency[batch_size] = (time.perf_counter() - start) / (10 * batch_size)
+            report[name] = {
+                "params": model.count_params(),
+                "size": os.path.getsize(os.path.join(self._artifact_path(meta['version']), "model.h5")),
+                "latency": latency,
+                "accuracy": self.evaluate()
+            }
+        (self.ARCHITECTURE, self.BACKEND) = (architecture, backend)
+        return report
+
+    def format_prediction(self, score: float) -> str:
+        '''
+        Human readable answer for one model output
+        '''
+        (model, meta) = self.load_model()
         return_value = "There"
-        return_value += " is a **Human**" if classes[0] < 0.5 else " is a **Shark**"
+        return_value += " is a **Human**" if score < 0.5 else " is a **Shark**"
         return_value += " in your image. "
-        acc_res = history.history['accuracy']
-        return_value += f"\nACC result: **{sum(acc_res) / len(acc_res)}**"
-        tf.keras.backend.clear_session()
+        return_value += f"\nACC result: **{meta['accuracy']}**"
         return return_value
+
+    def predict_image(self) -> str:
+        '''
+        Send object to analyse.
+        '''
+        with open(self.IMAGE_PATH, "rb") as f:
+            return self.predict_bytes(f)
+
+
+def main():
+    parser = ap.ArgumentParser(prog="ModelTrain",
+                               description="Train human/shark classifier and save model artifact")
+    parser.add_argument("--force", help="Retrain even if artifact for current data and hyperparameters exists",
+                        action='store_true')
+    parser.add_argument("--models", type=str, help="Directory for model artifacts", default=MODEL_DIR)
+    parser.add_argument("--pipeline", type=str, help="Input pipeline for training",
+                        choices=["generator", "tfdata", "shards"], default="generator")
+    parser.add_argument("--export-shards", help="Only precompute dataset shards for the shards pipeline",
+                        action='store_true')
+    parser.add_argument("--export-tflite", type=str, help="Export quantized TFLite model",
+                        choices=["int8", "float16"])
+    parser.add_argument("--compare-backends", help="Report validation accuracy and size of every backend",
+                        action='store_true')
+    parser.add_argument("--architecture", type=str, help="Model architecture",
+                        choices=list(ARCHITECTURES), default="dense")
+    parser.add_argument("--compare-architectures", help="Train every architecture and report size, latency and accuracy",
+                        action='store_true')
+
+    args = parser.parse_args()
+    model_object = ModelTrain()
+    model_object.MODEL_DIR = args.models
+    model_object.PIPELINE = args.pipeline
+    model_object.ARCHITECTURE = args.architecture
+    if args.export_shards:
+        for directory in (model_object.TRAIN_DIR, model_object.VALID_DIR):
+            print(f"Shards: {model_object.export_shards(directory)}")
+        return
+    if args.compare_architectures:
+        for (name, result) in model_object.compare_architectures().items():
+            latency = " ".join(f"b{size}={value * 1000:.2f}ms" for (size, value) in result['latency'].items())
+            print(f"{name:10} params={result['params']} size={result['size'] / 2**20:.1f} MB "
+                  f"acc={result['accuracy']:.4f} {latency}")
+        return
+    version = model_object.train(force=args.force)
+    print(f"Model artifact: {model_object._artifact_path(version)}")
+    if args.export_tflite:
+        print(f"TFLite model: {model_object.export_tflite(args.export_tflite)}")
+    if args.compare_backends:
+        for (name, result) in model_object.compare_backends().items():
+            print(f"{name:16} acc={result['accuracy']:.4f} ({result['accuracy_diff']:+.4f}) "
+                  f"size={result['size'] / 2**20:.1f} MB latency={result['latency'] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,118 @@
 import argparse
+import contextlib
+import errno
+import json
+import mmap
 import os
 import shutil
 import struct
-import winreg
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import winreg
+except ImportError:
+    # File operations work everywhere, the registry only on Windows
+    winreg = None
+
+CHUNK_SIZE = 1 << 20  # Bytes per read and write of streamed files
+COPY_CHUNK = 1 << 24  # Bytes per kernel copy call, progress is reported
+# Kernel copy can not work between these files, userspace copy is used
+COPY_FALLBACK = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF,
+                 errno.ENOTSUP, errno.ENOTSOCK, errno.EOPNOTSUPP}
+WORKERS = 16  # Threads of manifest mode
+
+
+def copy_file(source: str, destination: str, progress=None) -> int:
+    '''
+    Copy ``source`` to ``destination`` inside the kernel when it can:
+    ``copy_file_range``, then ``sendfile``, then chunked userspace copy.
+    ``progress(copied, size)`` is called after every chunk. Returns
+    number of copied bytes, a failed copy is removed
+    '''
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        raise shutil.SameFileError(
+            f"{source} and {destination} are the same file")
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        kernel_copies = [
+            lambda: os.copy_file_range(
+                src.fileno(), dst.fileno(), COPY_CHUNK, copied),
+            lambda: os.sendfile(
+                dst.fileno(), src.fileno(), copied, COPY_CHUNK)
+        ]
+        if not hasattr(os, "copy_file_range"):
+            kernel_copies.pop(0)
+        if not hasattr(os, "sendfile"):
+            kernel_copies.pop()
+        try:
+            for kernel_copy in kernel_copies:
+                try:
+                    while True:
+                        sent = kernel_copy()
+                        if not sent:
+                            break
+                        copied += sent
+                        if progress is not None:
+                            progress(copied, size)
+                except OSError as error:
+                    if error.errno not in COPY_FALLBACK:
+                        raise
+                # Some file systems stop the kernel copy early, the rest
+                # goes through the next method
+                if copied >= size:
+                    return copied
+            src.seek(copied)
+            dst.seek(copied)
+            buffer = bytearray(CHUNK_SIZE)
+            view = memoryview(buffer)
+            while True:
+                read = src.readinto(buffer)
+                if not read:
+                    break
+                dst.write(view[:read])
+                copied += read
+                if progress is not None:
+                    progress(copied, size)
+        except BaseException:
+            # No partial copy is left behind
+            with contextlib.suppress(OSError):
+                dst.close()
+            with contextlib.suppress(OSError):
+                os.remove(destination)
+            raise
+    return copied
+
+
+def move_file(source: str, destination: str, progress=None) -> int:
+    '''
+    Atomic ``os.replace`` on the same file system, copy and remove
+    between devices. Returns number of copied bytes
+    '''
+    try:
+        os.replace(source, destination)
+        return 0
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+    copied = copy_file(source, destination, progress)
+    shutil.copystat(source, destination)
+    os.remove(source)
+    return copied
+
+
+def print_progress(copied: int, size: int) -> None:
+    '''
+    ``progress`` of ``copy_file`` for the console
+    '''
+    percent = copied * 100 // size if size else 100
+    print(f"\r{copied / 2**20:.1f} of {size / 2**20:.1f} MB, {percent}%",
+          end="", file=sys.stderr, flush=True)
+    if copied >= size:
+        print(file=sys.stderr)
 
 
 class FileSystem(object):
@@ -31,16 +141,14 @@ class FileSystem(object):
         '''
         Write input buffer to file
         '''
-        new_data = input("Print string to file: ")
-        with open(self.filename, "a") as f:
-            f.write(new_data)
+        write_file(self.filename, input("Print string to file: "))
 
     def file_delete(self) -> None:
         '''
         Delete file by file name
         '''
         try:
-            os.remove(self.filename)
+            delete_file(self.filename)
             print("File deleted")
         except FileNotFoundError:
             print("File not found error")
@@ -50,19 +158,23 @@ class FileSystem(object):
         Create an empty file
         '''
         try:
-            with open(self.filename, "x") as f:
-                pass
+            create_file(self.filename)
         except FileExistsError:
             print(f"{self.filename} is already exist")
 
-    def file_rename(self, new_name: str) -> None:
+    def file_rename(self, new_name: str, progress=None) -> None:
         '''
-        Rename file from arguments to file with name ``new_name``
+        Rename file from arguments to file with name ``new_name``.
+        On the same file system it is one atomic ``os.replace``, file is
+        copied and removed only between devices
         '''
         try:
-            shutil.copyfile(self.filename, new_name)
-            os.remove(self.filename)
-            print("File copied successfully.")
+            move_file(self.filename, new_name, progress)
+            self.filename = new_name
+            print("File renamed successfully.")
+
+        except FileNotFoundError:
+            print(f"{self.filename} is not found")
 
         except shutil.SameFileError:
             print("Source and destination represents the same file.")
@@ -73,27 +185,75 @@ class FileSystem(object):
         except PermissionError:
             print("Permission denied.")
 
-    def file_read(self) -> None:
+    def read_to(self, out, offset: int = 0, length: int = None,
+                use_mmap: bool = False) -> int:
+        '''
+        Write ``length`` bytes of file from ``offset`` to binary ``out``
+        by ``CHUNK_SIZE`` chunks, whole file by default. With ``use_mmap``
+        only the range is mapped and pages are written from the mapping.
+        Returns number of written bytes
         '''
-        Read all data from file and print it
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError(
+                f"Offset and length must not be negative, got {offset} "
+                f"and {length}")
+        written = 0
+        with open(self.filename, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            end = size if length is None else min(size, offset + length)
+            if offset >= end:
+                return 0
+            if use_mmap:
+                # Mapping starts at the allocation granularity boundary
+                start = offset - offset % mmap.ALLOCATIONGRANULARITY
+                with mmap.mmap(f.fileno(), end - start, offset=start,
+                               access=mmap.ACCESS_READ) as mapped:
+                    if hasattr(mapped, "madvise"):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    with memoryview(mapped) as view:
+                        for position in range(offset - start, end - start,
+                                              CHUNK_SIZE):
+                            chunk = view[position:min(position + CHUNK_SIZE,
+                                                      end - start)]
+                            out.write(chunk)
+                            written += len(chunk)
+                            chunk.release()
+                return written
+            f.seek(offset)
+            buffer = bytearray(CHUNK_SIZE)
+            view = memoryview(buffer)
+            while written < end - offset:
+                read = f.readinto(view[:min(CHUNK_SIZE,
+                                            end - offset - written)])
+                if not read:
+                    break
+                out.write(view[:read])
+                written += read
+        return written
+
+    def file_read(self, offset: int = 0, length: int = None,
+                  use_mmap: bool = False) -> None:
         '''
-        buffer = str()
+        Read data from file and print it. The file is streamed by chunks,
+        so it is never whole in memory
+        '''
+        print("Data from file:\n===START OF FILE===")
+        sys.stdout.flush()
         try:
-            with open(self.filename, "r") as f:
-                buffer = f.read()
+            self.read_to(sys.stdout.buffer, offset, length, use_mmap)
+            sys.stdout.buffer.flush()
         except FileNotFoundError:
             print(f"{self.filename} is not found")
-        print(
-            f"Data from file:\n\
-===START OF FILE===\
-\n{buffer}\n\
-===END OF FILE===\n")
+        except ValueError as error:
+            print(error)
+        print("\n===END OF FILE===\n")
 
-    def file_copy(self, new_dir: str) -> None:
+    def file_copy(self, new_dir: str, progress=None) -> None:
         '''
-        Copy file to another directory with name ``new_dir``
+        Copy file to another directory with name ``new_dir``, the copy
+        keeps only the name of the file, like ``copy`` of manifest mode
         '''
-        shutil.copyfile(self.filename, f"{new_dir}/{self.filename}")
+        copy_to(self.filename, new_dir, progress)
 
 
 class WinReg(object):
@@ -150,12 +310,253 @@ class WinReg(object):
         winreg.CloseKey(self.key)
 
 
+def create_file(file: str) -> int:
+    with open(file, "x"):
+        return 0
+
+
+def delete_file(file: str) -> int:
+    os.remove(file)
+    return 0
+
+
+def write_file(file: str, data: str) -> int:
+    with open(file, "a") as f:
+        return f.write(data)
+
+
+def read_file(file: str, offset: int = 0, length: int = None,
+              use_mmap: bool = False, out: str = None) -> int:
+    with open(out or os.devnull, "wb") as sink:
+        return FileSystem(file).read_to(sink, offset, length, use_mmap)
+
+
+def copy_to(file: str, to: str, progress=None) -> int:
+    return copy_file(file, os.path.join(to, os.path.basename(file)),
+                     progress)
+
+
+def rename_file(file: str, to: str) -> int:
+    return move_file(file, to)
+
+
+# Operations of manifest mode, they raise errors instead of printing
+# them and return number of processed bytes
+OPERATIONS = {
+    'create': create_file,
+    'delete': delete_file,
+    'rename': rename_file,
+    'write': write_file,
+    'read': read_file,
+    'copy': copy_to
+}
+REQUIRED = {
+    'rename': ("to",),
+    'write': ("data",),
+    'copy': ("to",)
+}
+
+
+def read_manifest(stream) -> list:
+    '''
+    Operations from JSON Lines: ``{"op": "rename", "file": "a.txt",
+    "to": "b.txt"}``. ``write`` takes ``data``, ``copy`` takes ``to``
+    directory, ``read`` takes ``offset``, ``length``, ``use_mmap`` and
+    ``out`` file instead of printing. A broken line is kept with its
+    ``error``, it is reported as failed and the others still run
+    '''
+    operations = list()
+    for (number, line) in enumerate(stream, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        operation = dict()
+        try:
+            parsed = json.loads(line)
+            if not isinstance(parsed, dict):
+                raise ValueError("operation is not a JSON object")
+            operation = parsed
+            if not isinstance(operation.get("op"), str) or \
+                    operation["op"] not in OPERATIONS:
+                raise ValueError(f"unknown operation {operation.get('op')}")
+            for key in ("file", *REQUIRED.get(operation["op"], ())):
+                if key not in operation:
+                    raise ValueError(f"no {key} for {operation['op']}")
+            for key in ("file", "to", "data", "out"):
+                if key in operation and not isinstance(operation[key], str):
+                    raise ValueError(f"{key} is not a string")
+        except ValueError as error:
+            op = operation.get("op")
+            operation = {"op": op if isinstance(op, str) and op in OPERATIONS
+                         else None,
+                         "file": operation.get("file"),
+                         "error": f"Line {number} of manifest: {error}"}
+        operation["line"] = number
+        operations.append(operation)
+    return operations
+
+
+def operation_paths(operation: dict) -> list:
+    '''
+    Paths the operation reads or changes
+    '''
+    paths = [operation["file"]]
+    match operation["op"]:
+        case "rename":
+            paths.append(operation["to"])
+        case "copy":
+            paths.append(os.path.join(operation["to"],
+                                      os.path.basename(operation["file"])))
+        case "read" if operation.get("out"):
+            paths.append(operation["out"])
+    return [os.path.normcase(os.path.abspath(path)) for path in paths]
+
+
+def chains(operations: list) -> list:
+    '''
+    Operations split into chains sharing no path. Order of the manifest
+    is kept inside a chain, different chains may run in parallel
+    '''
+    parent = dict()
+
+    def find(path: str) -> str:
+        while parent.setdefault(path, path) != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    for operation in operations:
+        (first, *others) = operation_paths(operation)
+        for path in others:
+            if find(path) != find(first):
+                parent[find(path)] = find(first)
+    groups = dict()
+    for operation in operations:
+        groups.setdefault(find(operation_paths(operation)[0]),
+                          list()).append(operation)
+    return list(groups.values())
+
+
+def run_manifest(operations: list, workers: int = WORKERS,
+                 report=None) -> dict:
+    '''
+    Run operations on a thread pool, ``report(result)`` gets every
+    result as soon as it is ready. Returns summary of the run
+    '''
+    lock = threading.Lock()
+    totals = dict()
+
+    def record(result: dict, name: str) -> None:
+        with lock:
+            total = totals.setdefault(name, {"count": 0, "failed": 0,
+                                             "bytes": 0, "seconds": 0.0})
+            total["count"] += 1
+            total["failed"] += not result["ok"]
+            total["bytes"] += result["bytes"]
+            total["seconds"] += result["seconds"]
+            if report is not None:
+                report(result)
+
+    def run_chain(chain: list) -> None:
+        for operation in chain:
+            options = {key: value for (key, value) in operation.items()
+                       if key not in ("op", "file", "line")}
+            result = {"line": operation["line"], "op": operation["op"],
+                      "file": operation["file"], "ok": True, "bytes": 0,
+                      "error": None}
+            start = time.perf_counter()
+            try:
+                result["bytes"] = OPERATIONS[operation["op"]](
+                    operation["file"], **options)
+            except (OSError, TypeError, ValueError, OverflowError) as error:
+                (result["ok"], result["error"]) = (False, str(error))
+            result["seconds"] = time.perf_counter() - start
+            record(result, operation["op"])
+
+    # Broken lines are never run, they have own total
+    for operation in operations:
+        if "error" in operation:
+            record({"line": operation["line"], "op": operation["op"],
+                    "file": operation["file"], "ok": False, "bytes": 0,
+                    "error": operation["error"], "seconds": 0.0}, "invalid")
+    operations = [operation for operation in operations
+                  if "error" not in operation]
+    start = time.perf_counter()
+    # Long chains first, so they do not start last and run alone
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(run_chain, chain) for chain in
+                       sorted(chains(operations), key=len, reverse=True)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    count = sum(total["count"] for total in totals.values())
+    invalid = totals.get("invalid", {"count": 0})["count"]
+    processed = sum(total["bytes"] for total in totals.values())
+    return {
+        "operations": count,
+        "failed": sum(total["failed"] for total in totals.values()),
+        "invalid": invalid,
+        "seconds": elapsed,
+        "operations_per_s": (count - invalid) / elapsed if elapsed else 0.0,
+        "mb_per_s": processed / elapsed / 2**20 if elapsed else 0.0,
+        "by_operation": totals
+    }
+
+
+def run_manifest_file(path: str, workers: int) -> None:
+    '''
+    Manifest mode of the command line: results as JSON Lines to stdout,
+    summary to stderr
+    '''
+    if path == "-":
+        operations = read_manifest(sys.stdin)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            operations = read_manifest(f)
+
+    def report(result: dict) -> None:
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    summary = run_manifest(operations, workers, report)
+    sys.stdout.flush()
+    print(f"{summary['operations']} operations, {summary['failed']} failed "
+          f"({summary['invalid']} invalid) in {summary['seconds']:.2f} s: "
+          f"{summary['operations_per_s']:.0f} operations/s, "
+          f"{summary['mb_per_s']:.1f} MB/s", file=sys.stderr)
+    for (name, total) in sorted(summary["by_operation"].items()):
+        print(f"    {name:7} {total['count']:8} done {total['failed']:6} "
+              f"failed {total['seconds'] / total['count'] * 1000:8.3f} "
+              f"ms average", file=sys.stderr)
+
+
+def non_negative(value: str) -> int:
+    '''
+    ``type`` of byte counts of the command line
+    '''
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"{value} is negative")
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog="FileSystem", description="A Python script that allows you to \
             perform operations on Windows files and registry")
     parser.add_argument("-f", "--file", help="Work with files")
     parser.add_argument("-k", "--key", help="Work with Windows registry")
+    parser.add_argument("--offset", type=non_negative, default=0,
+                        help="Read from this byte of file")
+    parser.add_argument("--length", type=non_negative,
+                        help="Read only this many bytes")
+    parser.add_argument("--mmap", action="store_true",
+                        help="Read through memory mapping of the file")
+    parser.add_argument("--progress", action="store_true",
+                        help="Show progress of copy")
+    parser.add_argument("-m", "--manifest", metavar="FILE",
+                        help="Run JSON Lines operations from FILE or - for \
+                        stdin, one result per line is printed")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Threads of manifest mode")
 
     file_commands = parser.add_argument_group("Work with FileSystem")
     file_commands.add_argument(
@@ -185,6 +586,21 @@ DIRNAME")
 
     args = parser.parse_args()
     file_object, key_object = None, None
+    progress = print_progress if args.progress else None
+    file_options = {
+        "read": {"offset": args.offset, "length": args.length,
+                 "use_mmap": args.mmap},
+        "rename": {"progress": progress},
+        "copy": {"progress": progress}
+    }
+    del args.offset, args.length, args.mmap, args.progress
+    if args.manifest:
+        try:
+            run_manifest_file(args.manifest, args.workers)
+        except (OSError, ValueError) as error:
+            print(error)
+        return
+    del args.manifest, args.workers
 
     match args.file or args.key:
         case None:
@@ -200,6 +616,9 @@ DIRNAME")
             match args.key:
                 case None:
                     pass
+                case _ if winreg is None:
+                    print("Windows registry is only available on Windows")
+                    return
                 case _:
                     key_object = WinReg(key_name=args.key)
 
@@ -210,14 +629,16 @@ DIRNAME")
     for key in args_dict:
         if args_dict[key] is True:
             if file_object is not None:
-                getattr(locals()["file_object"], file_object.commands[key])()
+                getattr(locals()["file_object"], file_object.commands[key])(
+                    **file_options.get(key, {}))
             if key_object is not None:
                 getattr(locals()["key_object"], key_object.commands[key])()
                 key_object.close()
         if type(args_dict[key]) is str:
             if file_object is not None:
                 getattr(locals()["file_object"],
-                        file_object.commands[key])(args_dict[key])
+                        file_object.commands[key])(
+                    args_dict[key], **file_options.get(key, {}))
             if key_object is not None:
                 getattr(locals()["key_object"],
                         key_object.commands[key])(args_dict[key])
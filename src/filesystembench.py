@@ -0,0 +1,150 @@
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from filesystem import CHUNK_SIZE, FileSystem, copy_file
+
+'''
+Benchmark of FileSystem read, rename and copy against the old
+behaviour: whole file in one string, rename as copy and remove,
+``shutil.copyfile``. Files are read from the warm page cache
+'''
+SIZES = "1M,16M,256M,1G"
+UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+def parse_size(size: str) -> int:
+    size = size.strip().upper()
+    if size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def make_file(path: str, size: int) -> None:
+    '''
+    Text file of ``size`` bytes, the old read decodes it
+    '''
+    block = (b"0123456789abcdef" * 63 + b"0123456789abcde\n") * (
+        CHUNK_SIZE // 1024)
+    with open(path, "wb") as f:
+        for _ in range(size // len(block)):
+            f.write(block)
+        f.write(block[:size % len(block)])
+
+
+def legacy_read(path: str, out) -> None:
+    with open(path, "r") as f:
+        buffer = f.read()
+    print(
+        f"Data from file:\n===START OF FILE===\n{buffer}\n===END OF FILE===\n",
+        file=out)
+
+
+def legacy_rename(path: str, new_name: str) -> None:
+    shutil.copyfile(path, new_name)
+    os.remove(path)
+
+
+def measure(run) -> tuple:
+    '''
+    Seconds and peak of Python memory of ``run()``
+    '''
+    tracemalloc.start()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (elapsed, peak)
+
+
+def bench_size(folder: str, other: str, size: int, legacy_limit: int) -> list:
+    path = os.path.join(folder, "bench.txt")
+    make_file(path, size)
+    copies = os.path.join(folder, "copies")
+    os.makedirs(copies, exist_ok=True)
+    file = FileSystem(path)
+    legacy = size <= legacy_limit
+    devnull = open(os.devnull, "w")
+    # Read is printed to a file: /dev/null would not even touch mapped pages
+    out = open(os.path.join(copies, "out.txt"), "w")
+    runs = [
+        ("read old", legacy, lambda: legacy_read(path, out)),
+        ("read chunks", True, lambda: file.read_to(out.buffer)),
+        ("read mmap", True, lambda: file.read_to(out.buffer, use_mmap=True)),
+        ("copy old", True, lambda: shutil.copyfile(
+            path, os.path.join(copies, "old.txt"))),
+        ("copy kernel", True, lambda: copy_file(
+            path, os.path.join(copies, "new.txt"))),
+        ("rename old", True, lambda: legacy_rename(
+            os.path.join(copies, "old.txt"), os.path.join(copies, "a.txt"))),
+        ("rename replace", True, lambda: FileSystem(
+            os.path.join(copies, "new.txt")).file_rename(
+                os.path.join(copies, "b.txt"))),
+    ]
+    if other:
+        runs.extend([
+            ("move old", True, lambda: legacy_rename(
+                os.path.join(copies, "a.txt"),
+                os.path.join(other, "bench_a.txt"))),
+            ("move across", True, lambda: FileSystem(
+                os.path.join(copies, "b.txt")).file_rename(
+                    os.path.join(other, "bench_b.txt")))
+        ])
+    results = list()
+    # Status lines of FileSystem methods are not part of the results
+    with contextlib.redirect_stdout(devnull):
+        for (name, enabled, run) in runs:
+            if not enabled:
+                results.append((name, None, None))
+                continue
+            results.append((name, *measure(run)))
+            out.seek(0)
+            out.truncate()
+    devnull.close()
+    out.close()
+    shutil.rmtree(copies)
+    os.remove(path)
+    if other:
+        for name in ("bench_a.txt", "bench_b.txt"):
+            os.remove(os.path.join(other, name))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="FileSystemBench", description="Compare streamed and kernel \
+            file operations with the old ones")
+    parser.add_argument("--sizes", default=SIZES,
+                        help="Comma separated file sizes, e.g. 1M,1G,4G")
+    parser.add_argument("--dir", help="Folder for test files, temporary \
+                        by default")
+    parser.add_argument("--other-dir", help="Folder on another device \
+                        for moves between file systems, e.g. /dev/shm")
+    parser.add_argument("--legacy-limit", default="256M",
+                        help="Old read loads the file into memory a few \
+                        times, it is skipped for bigger files")
+    args = parser.parse_args()
+
+    folder = args.dir or tempfile.mkdtemp()
+    for size in args.sizes.split(","):
+        print(f"{size}:")
+        size = parse_size(size)
+        for (name, elapsed, peak) in bench_size(
+                folder, args.other_dir, size, parse_size(args.legacy_limit)):
+            if elapsed is None:
+                print(f"    {name:15} skipped")
+                continue
+            print(f"    {name:15} {elapsed:8.3f} s "
+                  f"{size / elapsed / 2**20:9.1f} MB/s "
+                  f"{peak / 2**20:9.1f} MB peak")
+    if not args.dir:
+        os.rmdir(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING, Callable
+
+from metrics import METRICS
+
+# numpy is imported where it is used, so the bot process starts without it
+if TYPE_CHECKING:
+    import numpy as np
+
+
+class BatchInference:
+    '''
+    Micro-batching inference service. Images from concurrent callers
+    are collected into one batch up to ``max_batch`` images or
+    ``max_wait`` seconds and sent to ``predict_fn`` in one call
+    '''
+
+    def __init__(self, predict_fn: Callable[['np.ndarray'], 'np.ndarray'],
+                 max_batch: int = 32, max_wait: float = 0.05, queue_size: int = 256) -> None:
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue(maxsize=queue_size)
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "max_batch_size": 0,
+            "errors": 0
+        }
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="BatchInference", daemon=True)
+        self._worker.start()
+
+    def submit(self, image: 'np.ndarray', timeout: float = None) -> Future:
+        '''
+        Put one image in the queue. Blocks up to ``timeout`` seconds
+        (raises ``queue.Full``) when queue is full
+        '''
+        future = Future()
+        self.requests.put((image, future), timeout=timeout)
+        return future
+
+    def predict(self, image: 'np.ndarray', timeout: float = None) -> float:
+        '''
+        Blocking helper: submit image and wait for its score
+        '''
+        return self.submit(image, timeout=timeout).result(timeout=timeout)
+
+    def _collect(self) -> list:
+        '''
+        Wait for first request and then fill batch until it is full
+        or ``max_wait`` is over
+        '''
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        import numpy as np
+        while True:
+            batch = self._collect()
+            images = np.stack([image for (image, future) in batch])
+            with self._lock:
+                self.stats["requests"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+            try:
+                scores = self.predict_fn(images)
+            except BaseException as error:
+                with self._lock:
+                    self.stats["errors"] += 1
+                for (image, future) in batch:
+                    future.set_exception(error)
+                continue
+            for ((image, future), score) in zip(batch, scores):
+                future.set_result(float(score))
+
+    def get_stats(self) -> dict:
+        '''
+        Queue depth and batch size statistics
+        '''
+        with self._lock:
+            stats = dict(self.stats)
+        stats["queue_depth"] = self.requests.qsize()
+        stats["mean_batch_size"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+
+def _collect_tasks(tasks: mp.Queue, max_batch: int, max_wait: float) -> list:
+    '''
+    Same batching as ``BatchInference._collect`` over process queue
+    '''
+    batch = [tasks.get()]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < max_batch and batch[-1] is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(tasks.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _worker_main(worker_id: int, tasks: mp.Queue, results: mp.SimpleQueue, settings: dict) -> None:
+    '''
+    Inference worker process: load model once, then classify
+    batches of raw images from ``tasks``
+    '''
+    import numpy as np
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(settings['threads'])
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    from classification import HYPERPARAMS, ModelNotTrainedError, ModelTrain
+
+    model_object = ModelTrain()
+    model_object.BACKEND = settings['backend']
+    model_object.ARCHITECTURE = settings['architecture']
+    model_object.THREADS = settings['threads']
+    model_object.TRAIN_MISSING = False
+    start = time.perf_counter()
+    try:
+        (model, meta) = model_object.load_model()
+    except ModelNotTrainedError as error:
+        results.put(("failed", worker_id, None, error))
+        return
+    model_object.predict_batch(np.zeros((1, *HYPERPARAMS['target_size'], 3), dtype=np.float32))
+    results.put(("ready", worker_id, meta['version'], time.perf_counter() - start))
+
+    images = np.empty((settings['max_batch'], *HYPERPARAMS['target_size'], 3), dtype=np.float32)
+    while True:
+        batch = _collect_tasks(tasks, settings['max_batch'], settings['max_wait'])
+        stop = batch[-1] is None
+        batch = [task for task in batch if task is not None]
+        results.put(("taken", worker_id, [request_id for (request_id, data) in batch], None))
+        decoded = list()
+        start = time.perf_counter()
+        for (request_id, data) in batch:
+            try:
+                model_object.decode_image(data, out=images[len(decoded)])
+                decoded.append(request_id)
+            except BaseException as error:
+                results.put(("done", worker_id, request_id, error))
+        decode_time = time.perf_counter() - start
+        if decoded:
+            try:
+                start = time.perf_counter()
+                scores = model_object.predict_batch(images[:len(decoded)])
+                results.put(("batch", worker_id, len(decoded), (decode_time, time.perf_counter() - start)))
+                for (request_id, score) in zip(decoded, scores):
+                    results.put(("done", worker_id, request_id, model_object.format_prediction(score)))
+            except BaseException as error:
+                for request_id in decoded:
+                    results.put(("done", worker_id, request_id, error))
+        if stop:
+            return
+
+
+class ProcessInference:
+    '''
+    Pool of inference worker processes with warm models. Raw image
+    bytes go through one task queue, so handler process only waits
+    for futures. Dead workers are restarted and their requests failed
+    '''
+
+    def __init__(self, workers: int = None, max_batch: int = 32, max_wait: float = 0.05,
+                 queue_size: int = 256, backend: str = "keras", architecture: str = "dense",
+                 health_interval: float = 5.0) -> None:
+        self.workers = workers or os.cpu_count()
+        self.settings = {
+            "max_batch": max_batch,
+            "max_wait": max_wait,
+            "backend": backend,
+            "architecture": architecture,
+            "threads": max(1, os.cpu_count() // self.workers)
+        }
+        self.health_interval = health_interval
+        self._context = mp.get_context("spawn")
+        self.tasks = self._context.Queue(maxsize=queue_size)
+        # SimpleQueue writes synchronously, so "taken" reaches us even if worker crashes right after
+        self.results = self._context.SimpleQueue()
+        self.stats = {
+            "requests": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "restarts": 0
+        }
+        self._ids = itertools.count()
+        self._pending = dict()
+        self._inflight = {worker_id: set() for worker_id in range(self.workers)}
+        self._ready = set()
+        # Version of the model loaded by the last ready worker
+        self.model_version = None
+        # Error of workers that can not load the model, they are not restarted then
+        self.failure = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._processes = [self._spawn(worker_id) for worker_id in range(self.workers)]
+        threading.Thread(target=self._dispatch, name="ProcessInference-results", daemon=True).start()
+        threading.Thread(target=self._monitor, name="ProcessInference-health", daemon=True).start()
+
+    def _spawn(self, worker_id: int) -> mp.Process:
+        process = self._context.Process(target=_worker_main, name=f"inference-{worker_id}",
+                                        args=(worker_id, self.tasks, self.results, self.settings),
+                                        daemon=True)
+        process.start()
+        return process
+
+    def submit(self, data: bytes, timeout: float = None) -> Future:
+        '''
+        Put raw image in the queue. Raises ``queue.Full`` when
+        it stays full for ``timeout`` seconds
+        '''
+        future = Future()
+        if self.failure is not None:
+            future.set_exception(self.failure)
+            return future
+        request_id = next(self._ids)
+        with self._lock:
+            self._pending[request_id] = future
+            self.stats["requests"] += 1
+        try:
+            self.tasks.put((request_id, data), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise
+        future.request_id = request_id
+        return future
+
+    def predict(self, data: bytes, timeout: float = None) -> str:
+        '''
+        Blocking helper: classify raw image and return answer text.
+        Raises ``TimeoutError`` after ``timeout`` seconds
+        '''
+        future = self.submit(data, timeout=timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._pending.pop(future.request_id, None)
+                self.stats["timeouts"] += 1
+            raise TimeoutError(f"No prediction in {timeout} s") from None
+
+    def _dispatch(self) -> None:
+        while not self._closed.is_set():
+            (kind, worker_id, payload, result) = self.results.get()
+            with self._lock:
+                match kind:
+                    case "ready":
+                        self._ready.add(worker_id)
+                        self.model_version = payload
+                        METRICS.observe("inference_model_load_seconds", result)
+                    case "failed":
+                        self.failure = result
+                        for future in self._pending.values():
+                            future.set_exception(result)
+                        self._pending.clear()
+                    case "batch":
+                        (decode_time, predict_time) = result
+                        METRICS.observe("inference_decode_seconds", decode_time)
+                        METRICS.observe("inference_model_seconds", predict_time)
+                        METRICS.inc("inference_batches_total")
+                        METRICS.inc("inference_images_total", payload)
+                    case "taken":
+                        self._inflight[worker_id].update(payload)
+                    case "done":
+                        self._inflight[worker_id].discard(payload)
+                        future = self._pending.pop(payload, None)
+                        if future is None:
+                            continue
+                        if isinstance(result, BaseException):
+                            self.stats["errors"] += 1
+                            future.set_exception(result)
+                        else:
+                            future.set_result(result)
+
+    def _monitor(self) -> None:
+        '''
+        Health check: restart dead workers and fail their requests
+        '''
+        while not self._closed.wait(self.health_interval):
+            for (worker_id, process) in enumerate(self._processes):
+                if process.is_alive() or self.failure is not None:
+                    continue
+                with self._lock:
+                    self.stats["restarts"] += 1
+                    self._ready.discard(worker_id)
+                    for request_id in self._inflight[worker_id]:
+                        future = self._pending.pop(request_id, None)
+                        if future is not None:
+                            future.set_exception(RuntimeError(f"Inference worker {worker_id} died"))
+                    self._inflight[worker_id].clear()
+                self._processes[worker_id] = self._spawn(worker_id)
+
+    def get_stats(self) -> dict:
+        '''
+        Request counters, queue depth and workers state
+        '''
+        with self._lock:
+            stats = dict(self.stats)
+            stats["pending"] = len(self._pending)
+            stats["ready_workers"] = len(self._ready)
+            stats["model_version"] = self.model_version
+            stats["failure"] = None if self.failure is None else str(self.failure)
+        stats["workers"] = self.workers
+        stats["alive_workers"] = sum(process.is_alive() for process in self._processes)
+        try:
+            stats["queue_depth"] = self.tasks.qsize()
+        except NotImplementedError:
+            stats["queue_depth"] = -1
+        return stats
+
+    def close(self, timeout: float = 5.0) -> None:
+        '''
+        Stop workers after they finish queued requests
+        '''
+        self._closed.set()
+        for _ in self._processes:
+            self.tasks.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+def main():
+    import argparse as ap
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
+
+    from classification import HYPERPARAMS, ModelTrain
+
+    parser = ap.ArgumentParser(prog="BatchInference",
+                               description="Compare per-request and micro-batched prediction throughput")
+    parser.add_argument("-n", type=int, help="Number of images", default=256)
+    parser.add_argument("--users", type=int, help="Concurrent callers", default=32)
+    parser.add_argument("--batch", type=int, help="Max batch size", default=32)
+    parser.add_argument("--wait", type=float, help="Max batch wait in seconds", default=0.05)
+    args = parser.parse_args()
+
+    model_object = ModelTrain()
+    model_object.load_model()
+    images = np.random.random((args.n, *HYPERPARAMS['target_size'], 3)).astype(np.float32)
+
+    start = time.perf_counter()
+    for image in images:
+        model_object.predict_batch(image[np.newaxis])
+    single = args.n / (time.perf_counter() - start)
+
+    engine = BatchInference(model_object.predict_batch, max_batch=args.batch, max_wait=args.wait)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(engine.predict, images))
+    batched = args.n / (time.perf_counter() - start)
+
+    print(f"per-request: {single:.1f} img/s")
+    print(f"batched:     {batched:.1f} img/s ({batched / single:.1f}x)")
+    print(engine.get_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from startup import current_rss
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Metrics:
+    '''
+    Counters, timing summaries with p50/p95/p99 over the last
+    ``window`` observations and gauges collected on scrape.
+    Rendered in Prometheus text format, every observation can be
+    also written as JSON line to ``json_log_path``
+    '''
+
+    def __init__(self, window: int = 1024, json_log_path: str = None) -> None:
+        self.window = window
+        self._counters = dict()
+        self._timings = dict()
+        self._collectors = dict()
+        self._lock = threading.Lock()
+        self._json_log = None
+        if json_log_path:
+            self.set_json_log(json_log_path)
+
+    def set_json_log(self, path: str) -> None:
+        self._json_log = open(path, "a", buffering=1)
+
+    def _log(self, kind: str, name: str, value: float, labels: dict) -> None:
+        if self._json_log is not None:
+            record = json.dumps({"ts": time.time(), "kind": kind, "name": name, "value": value, **labels})
+            with self._lock:
+                self._json_log.write(record + "\n")
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._log("counter", name, value, labels)
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timing = self._timings.get(key)
+            if timing is None:
+                timing = self._timings[key] = [deque(maxlen=self.window), 0, 0.0]
+            timing[0].append(seconds)
+            timing[1] += 1
+            timing[2] += seconds
+        self._log("timing", name, seconds, labels)
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        '''
+        Time the block as ``name`` summary
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_collector(self, prefix: str, collect: Callable[[], dict]) -> None:
+        '''
+        ``collect()`` returns dict of numbers exported as ``prefix_key`` gauges
+        '''
+        self._collectors[prefix] = collect
+
+    def summary(self, name: str, **labels) -> dict:
+        '''
+        Count, sum and quantiles of one timing
+        '''
+        with self._lock:
+            (samples, count, total) = self._timings[(name, tuple(sorted(labels.items())))]
+            samples = sorted(samples)
+        result = {"count": count, "sum": total}
+        for quantile in QUANTILES:
+            result[quantile] = samples[min(len(samples) - 1, int(quantile * len(samples)))]
+        return result
+
+    @staticmethod
+    def _labels(labels: tuple, **extra) -> str:
+        items = list(labels) + list(extra.items())
+        if not items:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for (key, value) in items) + "}"
+
+    def render(self) -> str:
+        '''
+        All metrics in Prometheus text exposition format
+        '''
+        lines = list()
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {key: (sorted(samples), count, total)
+                       for (key, (samples, count, total)) in self._timings.items()}
+        for name in sorted({name for (name, labels) in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for ((metric, labels), value) in counters.items():
+                if metric == name:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+        for name in sorted({name for (name, labels) in timings}):
+            lines.append(f"# TYPE {name} summary")
+            for ((metric, labels), (samples, count, total)) in timings.items():
+                if metric != name:
+                    continue
+                for quantile in QUANTILES:
+                    value = samples[min(len(samples) - 1, int(quantile * len(samples)))]
+                    lines.append(f"{name}{self._labels(labels, quantile=quantile)} {value}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        gauges = {"process_resident_memory_bytes": current_rss() or 0,
+                  "process_threads": threading.active_count()}
+        for (prefix, collect) in list(self._collectors.items()):
+            try:
+                values = collect()
+            except BaseException:
+                continue
+            for (key, value) in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"{prefix}_{key}"] = value
+        for (name, value) in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        '''
+        Serve ``/metrics`` from daemon thread
+        '''
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="Metrics", daemon=True).start()
+        return server
+
+
+METRICS = Metrics()
+
+
+def instrumented(command: str):
+    '''
+    Decorator for bot handlers: count calls and time them
+    '''
+    def wrapper(handler):
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def timed(*args, **kwargs):
+                METRICS.inc("bot_commands_total", command=command)
+                with METRICS.span("bot_handler_seconds", command=command):
+                    return await handler(*args, **kwargs)
+        else:
+            @functools.wraps(handler)
+            def timed(*args, **kwargs):
+                METRICS.inc("bot_commands_total", command=command)
+                with METRICS.span("bot_handler_seconds", command=command):
+                    return handler(*args, **kwargs)
+        return timed
+    return wrapper
@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+CacheEntry = namedtuple("CacheEntry", ["value", "etag", "last_modified", "fetched"])
+
+
+class PageCache:
+    '''
+    Persistent cache of fetched pages by URL with their ETag and
+    Last-Modified validators. Freshness is decided by the caller,
+    so different pages can have different TTLs. Holds at most
+    ``max_bytes`` of values, least recently used pages go first
+    '''
+
+    def __init__(self, path: str, max_bytes: int = 64 * 2**20) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute('''CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched REAL NOT NULL,
+            used REAL NOT NULL,
+            size INTEGER NOT NULL)''')
+        self._db.execute("CREATE INDEX IF NOT EXISTS pages_used ON pages (used)")
+        (self._size,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()
+        self.stats = {
+            "hits": 0,
+            "revalidated": 0,
+            "misses": 0
+        }
+
+    def count(self, event: str) -> None:
+        with self._lock:
+            self.stats[event] += 1
+
+    def get(self, url: str) -> CacheEntry | None:
+        with self._lock:
+            row = self._db.execute("SELECT value, etag, last_modified, fetched FROM pages WHERE url = ?",
+                                   (url,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE pages SET used = ? WHERE url = ?", (time.time(), url))
+            return CacheEntry(*row)
+
+    def put(self, url: str, value: str, etag: str = None, last_modified: str = None) -> None:
+        now = time.time()
+        size = len(value.encode())
+        with self._lock:
+            row = self._db.execute("SELECT size FROM pages WHERE url = ?", (url,)).fetchone()
+            self._db.execute('''INSERT OR REPLACE INTO pages (url, value, etag, last_modified, fetched, used, size)
+                VALUES (?, ?, ?, ?, ?, ?, ?)''', (url, value, etag, last_modified, now, now, size))
+            self._size += size - (row[0] if row else 0)
+            if self._size > self.max_bytes:
+                self._prune()
+
+    def touch(self, url: str) -> None:
+        '''
+        Page was revalidated, it is fresh again
+        '''
+        now = time.time()
+        with self._lock:
+            self._db.execute("UPDATE pages SET fetched = ?, used = ? WHERE url = ?", (now, now, url))
+
+    def _prune(self) -> None:
+        # Down to 90% of the limit, so pruning does not run on every put
+        for (url, size) in self._db.execute("SELECT url, size FROM pages ORDER BY used").fetchall():
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            self._db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self._size -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM pages")
+            self._size = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            (stats["pages"],) = self._db.execute("SELECT COUNT(*) FROM pages").fetchone()
+        stats["bytes"] = self._size
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
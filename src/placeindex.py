@@ -0,0 +1,103 @@
+import difflib
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+'''
+Local index of buildings and their rooms for place lookups
+without network search
+'''
+
+
+def normalize(text: str) -> str:
+    '''
+    Lower case, ё as е, punctuation as spaces, single spaces
+    '''
+    text = re.sub(r"[^\w]+", " ", text.lower().replace("ё", "е"))
+    return " ".join(text.split())
+
+
+class PlaceIndex:
+    '''
+    Buildings ``{"id", "name", "abbr", "rooms": [{"id", "name"}]}``
+    with sorted keys of room and building names, so exact and prefix
+    lookups are a binary search. Building names fall back to fuzzy match
+    '''
+
+    def __init__(self, buildings: list, fetched: float = None) -> None:
+        self.buildings = buildings
+        self.fetched = fetched or time.time()
+        self._rooms = sorted((normalize(room['name']), building_index, room_index)
+                             for (building_index, building) in enumerate(buildings)
+                             for (room_index, room) in enumerate(building.get('rooms') or ()))
+        self._building_keys = sorted({(normalize(name), index)
+                                      for (index, building) in enumerate(buildings)
+                                      for name in (building.get('name'), building.get('abbr')) if name})
+
+    @staticmethod
+    def _prefixed(keys: list, prefix: str) -> list:
+        '''
+        Items of sorted ``keys`` whose first element starts with ``prefix``
+        '''
+        found = list()
+        for item in keys[bisect_left(keys, (prefix,)):]:
+            if not item[0].startswith(prefix):
+                break
+            found.append(item)
+        return found
+
+    def find_buildings(self, name: str) -> list:
+        '''
+        Buildings by exact name or abbreviation, then by prefix, then fuzzy
+        '''
+        key = normalize(name)
+        matches = self._prefixed(self._building_keys, key)
+        exact = [index for (found, index) in matches if found == key]
+        indexes = exact or [index for (found, index) in matches]
+        if not indexes:
+            close = difflib.get_close_matches(key, [found for (found, index) in self._building_keys], n=3, cutoff=0.6)
+            indexes = [index for (found, index) in self._building_keys if found in close]
+        return [self.buildings[index] for index in dict.fromkeys(indexes)]
+
+    def find_rooms(self, room: str, building: str = None) -> list:
+        '''
+        ``(building, room)`` pairs by room number, exact matches win over prefix ones
+        '''
+        key = normalize(room)
+        matches = self._prefixed(self._rooms, key)
+        exact = [item for item in matches if item[0] == key]
+        matches = exact or matches
+        if building is not None:
+            allowed = {id(found) for found in self.find_buildings(building)}
+            matches = [item for item in matches if id(self.buildings[item[1]]) in allowed]
+        return [(self.buildings[building_index], self.buildings[building_index]['rooms'][room_index])
+                for (key, building_index, room_index) in matches]
+
+    def save(self, path: str) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Own temporary file, concurrent refreshes of the index replace each other whole
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fetched": self.fetched, "buildings": self.buildings}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, max_age: float) -> 'PlaceIndex | None':
+        '''
+        Index saved not earlier than ``max_age`` seconds ago, None otherwise
+        '''
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - data.get("fetched", 0) > max_age:
+            return None
+        return cls(data["buildings"], data["fetched"])
+
+    def __len__(self) -> int:
+        return len(self._rooms)
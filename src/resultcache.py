@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    '''
+    Prediction results by content key (Telegram ``file_unique_id``
+    or hash of image bytes) and model version. In-memory LRU tier
+    of ``capacity`` entries and optional SQLite tier of ``disk_capacity``
+    entries. New model version never sees results of the old one
+    '''
+
+    def __init__(self, capacity: int = 10_000, disk_path: str = None, disk_capacity: int = 1_000_000) -> None:
+        self.capacity = capacity
+        self.disk_capacity = disk_capacity
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        self._disk_writes = 0
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("PRAGMA synchronous=NORMAL")
+            self._disk.execute('''CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                used REAL NOT NULL)''')
+            self._disk.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0
+        }
+
+    def _remember(self, key: str, value: str) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def get(self, version: str, key: str) -> str | None:
+        full_key = f"{version}:{key}"
+        with self._lock:
+            value = self._memory.get(full_key)
+            if value is not None:
+                self._memory.move_to_end(full_key)
+                self.stats["hits"] += 1
+                return value
+            if self._disk is not None:
+                row = self._disk.execute("SELECT value FROM results WHERE key = ?", (full_key,)).fetchone()
+                if row is not None:
+                    self._disk.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), full_key))
+                    self._remember(full_key, row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, version: str, value: str, *keys: str) -> None:
+        '''
+        Save result under every key of the same image
+        '''
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                if key is None:
+                    continue
+                full_key = f"{version}:{key}"
+                self._remember(full_key, value)
+                if self._disk is not None:
+                    self._disk.execute("INSERT OR REPLACE INTO results (key, value, used) VALUES (?, ?, ?)",
+                                       (full_key, value, now))
+                    self._disk_writes += 1
+            if self._disk is not None and self._disk_writes >= max(1, self.disk_capacity // 100):
+                self._disk_writes = 0
+                self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        # Old versions are never used again, so they are the first to go
+        (count,) = self._disk.execute("SELECT COUNT(*) FROM results").fetchone()
+        if count > self.disk_capacity:
+            self._disk.execute('''DELETE FROM results WHERE key IN (
+                SELECT key FROM results ORDER BY used LIMIT ?)''', (count - self.disk_capacity,))
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+        return stats
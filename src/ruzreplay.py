@@ -0,0 +1,303 @@
+import argparse as ap
+import hashlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests as req
+
+from pagecache import PageCache
+from ruzstate import STATE_KEYS, STATE_MARKER, extract_state
+from ruzstub import StubHandler, StubRuz
+from scheduler import (BASE_URL, MODES, POOL_SIZE, create_session, fetch_schedules, read_entries, reset_places,
+                       week_dates)
+
+'''
+Record and replay of schedule site answers. Recorder saves answers of
+real queries as fixtures, replay server answers them locally with
+latency and jitter, benchmark suite measures the scraper against it
+'''
+FIXTURES_PATH = "fixtures/ruz"
+INDEX_NAME = "index.json"
+REPLAY_PORT = 8780
+
+
+def answer_path(url: str) -> str:
+    '''
+    Path with query, as the server gets it in the request line
+    '''
+    url = urlsplit(url)
+    return f"{url.path}?{url.query}" if url.query else url.path
+
+
+class Recorder:
+    '''
+    Saves every successful answer of a session into ``folder``, one
+    file per page and ``index.json`` with paths, content types and
+    queries. Recording into existing fixtures adds to them
+    '''
+
+    def __init__(self, folder: str = FIXTURES_PATH) -> None:
+        self.folder = folder
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        try:
+            with open(os.path.join(folder, INDEX_NAME), "r", encoding="utf-8") as f:
+                index = json.load(f)
+            (self.answers, self.queries) = (index["answers"], [tuple(query) for query in index["queries"]])
+        except (OSError, ValueError, KeyError):
+            (self.answers, self.queries) = (dict(), list())
+
+    def attach(self, session: req.Session) -> req.Session:
+        session.hooks["response"].append(self.hook)
+        return session
+
+    def hook(self, response: req.Response, *args, **kwargs) -> None:
+        if response.status_code != 200:
+            return
+        path = answer_path(response.url)
+        content_type = response.headers.get("Content-Type", "text/html; charset=utf-8")
+        name = hashlib.sha1(path.encode()).hexdigest()[:16] + (".json" if "json" in content_type else ".html")
+        # Body is already decompressed, replay compresses it again if asked
+        with open(os.path.join(self.folder, name), "wb") as f:
+            f.write(response.content)
+        with self._lock:
+            self.answers[path] = {"file": name, "content_type": content_type, "size": len(response.content)}
+
+    def save(self, base_url: str, queries: list) -> None:
+        with self._lock:
+            self.queries.extend(query for query in queries if query not in self.queries)
+            index = {
+                "base_url": base_url,
+                "recorded": datetime.now().isoformat(timespec="seconds"),
+                "queries": self.queries,
+                "answers": self.answers
+            }
+        path = os.path.join(self.folder, INDEX_NAME)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=1)
+        os.replace(f"{path}.tmp", path)
+
+
+def record(queries: list, folder: str = FIXTURES_PATH, base_url: str = BASE_URL,
+           workers: int = POOL_SIZE) -> list:
+    '''
+    Fetch ``(mode, name, date)`` queries without cache and save every
+    answer, failed queries get their exception like in ``fetch_schedules``
+    '''
+    recorder = Recorder(folder)
+    session = recorder.attach(create_session(workers))
+    # Refresh makes place lookups fetch buildings and rooms, not read the saved index
+    results = fetch_schedules(queries, workers, session, base_url, refresh=True)
+    recorder.save(base_url, [query for (query, result) in zip(queries, results)
+                             if not isinstance(result, Exception)])
+    return results
+
+
+class Fixtures:
+    '''
+    Recorded answers in memory, by path with query
+    '''
+
+    def __init__(self, folder: str = FIXTURES_PATH) -> None:
+        with open(os.path.join(folder, INDEX_NAME), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.base_url = index["base_url"]
+        self.recorded = index["recorded"]
+        self.queries = [tuple(query) for query in index["queries"]]
+        self.answers = dict()
+        for (path, answer) in index["answers"].items():
+            with open(os.path.join(folder, answer["file"]), "rb") as f:
+                self.answers[path] = (f.read(), answer["content_type"])
+
+    def get(self, path: str) -> tuple | None:
+        return self.answers.get(path)
+
+    def pages(self) -> list:
+        '''
+        Recorded pages with initial state
+        '''
+        return [body for (body, content_type) in self.answers.values() if STATE_MARKER in body]
+
+
+class ReplayHandler(StubHandler):
+    def page(self) -> tuple | None:
+        return self.server.fixtures.get(self.path)
+
+
+class ReplayRuz(StubRuz):
+    '''
+    Stub site answering recorded fixtures, unknown paths are 404
+    '''
+    handler = ReplayHandler
+
+    def __init__(self, fixtures: Fixtures, port: int = 0, latency: float = 0.0, jitter: float = 0.0) -> None:
+        self.fixtures = fixtures
+        super().__init__(port, latency, jitter)
+
+
+def bench_fetch(server: ReplayRuz, queries: list, workers: int, repeat: int) -> dict:
+    '''
+    Median time of sequential and concurrent fetches without cache and
+    of cold, warm and revalidating cache, every repeat with a new cache.
+    Every run starts without buildings and rooms in memory, they come
+    from the site or the cache of the run like the other pages
+    '''
+    runs = dict()
+    session = create_session(workers)
+    for _ in range(repeat):
+        cache = PageCache(os.path.join(tempfile.mkdtemp(), "cache.sqlite3"))
+        suite = [
+            ("sequential", lambda: fetch_schedules(queries, 1, create_session(1), server.url)),
+            (f"concurrent x{workers}", lambda: fetch_schedules(queries, workers, session, server.url)),
+            ("cache cold", lambda: fetch_schedules(queries, workers, session, server.url, cache)),
+            ("cache warm", lambda: fetch_schedules(queries, workers, session, server.url, cache)),
+            ("cache revalidate", lambda: fetch_schedules(queries, workers, session, server.url, cache, refresh=True))
+        ]
+        for (name, run) in suite:
+            server.reset()
+            reset_places()
+            start = time.perf_counter()
+            results = run()
+            elapsed = time.perf_counter() - start
+            runs.setdefault(name, list()).append({
+                "seconds": elapsed,
+                "requests": server.requests,
+                "connections": server.connections,
+                "errors": sum(isinstance(result, Exception) for result in results)
+            })
+        cache.close()
+    summary = dict()
+    for (name, results) in runs.items():
+        seconds = statistics.median(result["seconds"] for result in results)
+        summary[name] = {
+            "seconds": seconds,
+            "queries_per_s": len(queries) / seconds,
+            "requests": results[-1]["requests"],
+            "connections": results[-1]["connections"],
+            "errors": results[-1]["errors"]
+        }
+    return summary
+
+
+def bench_parse(pages: list, repeat: int) -> dict:
+    '''
+    Cost of ``RequestSender.extract_initial_state`` on recorded pages and
+    of the members only extraction ``fetch_state`` uses
+    '''
+    keys = [tuple(key for key in STATE_KEYS if f'"{key}":'.encode() in page)[:1] for page in pages]
+    extractors = [
+        ("extract_initial_state", lambda page, page_keys: extract_state(page)),
+        ("needed members", lambda page, page_keys: extract_state(page, page_keys or None))
+    ]
+    size = sum(map(len, pages))
+    summary = dict()
+    for (name, extractor) in extractors:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for (page, page_keys) in zip(pages, keys):
+                extractor(page, page_keys)
+        elapsed = (time.perf_counter() - start) / repeat
+        summary[name] = {"us_per_page": elapsed / len(pages) * 1e6, "mb_per_s": size / elapsed / 2**20}
+    return summary
+
+
+def compare(results: dict, previous: dict) -> None:
+    '''
+    Print change of every measure against previous results
+    '''
+    for section in ("fetch", "parse"):
+        for (name, measures) in results[section].items():
+            old = previous.get(section, {}).get(name)
+            if old is None:
+                continue
+            measure = "seconds" if section == "fetch" else "us_per_page"
+            change = (measures[measure] / old[measure] - 1) * 100
+            print(f"{name:22} {old[measure]:10.4f} -> {measures[measure]:10.4f} {measure}  {change:+6.1f}%")
+
+
+def main():
+    parser = ap.ArgumentParser(prog="RuzReplay",
+                               description="Record schedule site answers, replay them locally and benchmark scheduler")
+    commands = parser.add_subparsers(dest="command", required=True)
+    recording = commands.add_parser("record", help="Fetch queries and save their answers as fixtures")
+    recording.add_argument("-m", type=int, choices=MODES, required=True,
+                           help="Default kind of names: 1 - teacher, 2 - group, 3 - place")
+    recording.add_argument("-b", type=str, required=True, metavar="FILE",
+                           help="Names from file or - for stdin, 'teacher:', 'group:' or 'place:' prefix overrides -m")
+    recording.add_argument("-d", type=str, required=True, help="First date of the range")
+    recording.add_argument("--to", type=str, help="Last date of the range")
+    recording.add_argument("--url", type=str, default=BASE_URL, help="Site to record")
+    recording.add_argument("--workers", type=int, default=POOL_SIZE)
+    serve = commands.add_parser("serve", help="Answer fixtures on the port")
+    bench = commands.add_parser("bench", help="Benchmark scheduler against replayed fixtures")
+    for command in (serve, bench):
+        command.add_argument("--port", type=int, default=REPLAY_PORT)
+        command.add_argument("--latency", type=float, default=0.05, help="Seconds added to every answer")
+        command.add_argument("--jitter", type=float, default=0.02, help="Up to this many seconds more")
+    bench.add_argument("--workers", type=int, default=POOL_SIZE)
+    bench.add_argument("--repeat", type=int, default=3, help="Fetch runs, the median is kept")
+    bench.add_argument("--parse-repeat", type=int, default=200)
+    bench.add_argument("--results", type=str, help="Results path, bench/ruzreplay_<time>.json by default")
+    bench.add_argument("--compare", type=str, metavar="RESULTS", help="Previous results to compare with")
+    parser.add_argument("--fixtures", type=str, default=FIXTURES_PATH, help="Fixtures folder")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        queries = [(kind, name, date) for (kind, name) in read_entries(args.b, MODES[args.m])
+                   for date in week_dates(args.d, args.to)]
+        start = time.perf_counter()
+        results = record(queries, args.fixtures, args.url, args.workers)
+        for (query, result) in zip(queries, results):
+            if isinstance(result, Exception):
+                print(f"{' '.join(query)}: {result}", file=sys.stderr)
+        errors = sum(isinstance(result, Exception) for result in results)
+        print(f"{len(queries) - errors} of {len(queries)} queries recorded into {args.fixtures} "
+              f"in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+        return
+
+    fixtures = Fixtures(args.fixtures)
+    server = ReplayRuz(fixtures, args.port, args.latency, args.jitter)
+    if args.command == "serve":
+        print(f"{len(fixtures.answers)} answers recorded from {fixtures.base_url} on {server.url}")
+        threading.Event().wait()
+
+    print(f"{len(fixtures.queries)} queries, {len(fixtures.answers)} answers recorded {fixtures.recorded}")
+    results = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fixtures": {"path": args.fixtures, "recorded": fixtures.recorded, "queries": len(fixtures.queries),
+                     "answers": len(fixtures.answers)},
+        "settings": {"latency": args.latency, "jitter": args.jitter, "workers": args.workers,
+                     "repeat": args.repeat, "parse_repeat": args.parse_repeat},
+        "fetch": bench_fetch(server, fixtures.queries, args.workers, args.repeat),
+        "parse": bench_parse(fixtures.pages(), args.parse_repeat)
+    }
+    server.shutdown()
+    for (name, run) in results["fetch"].items():
+        print(f"{name:22} {run['seconds']:7.3f} s  {run['queries_per_s']:7.1f} queries/s  "
+              f"{run['requests']} requests  {run['connections']} connections  {run['errors']} errors")
+    for (name, run) in results["parse"].items():
+        print(f"{name:22} {run['us_per_page']:9.1f} us/page  {run['mb_per_s']:7.1f} MB/s")
+
+    path = args.results or f"bench/ruzreplay_{datetime.now():%Y%m%d_%H%M%S}.json"
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results saved to {path}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
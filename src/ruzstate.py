@@ -0,0 +1,123 @@
+import argparse as ap
+import json
+import re
+import time
+
+'''
+Initial state of ruz.spbstu.ru pages. The state is a JSON object
+in a script of the page, it is found in raw bytes and only the bytes
+up to the end of that script are decoded, never the rest of the page.
+With ``keys`` only top level members up to the last asked one are scanned
+'''
+STATE_MARKER = b'{"faculties"'
+STATE_KEYS = ("searchGroup", "searchTeacher", "teacherSchedule", "lessons")
+SCRIPT_END = b"</script>"
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_KEY = re.compile(r'"((?:[^"\\]|\\.)*)"[ \t\n\r]*:[ \t\n\r]*')
+
+
+class StateExtractError(ValueError):
+    '''
+    Page has no initial state or it is broken
+    '''
+
+
+def _state_text(raw: bytes) -> str:
+    start = raw.find(STATE_MARKER)
+    if start < 0:
+        raise StateExtractError("No initial state in the page")
+    # JSON in a script can not hold "</script>", it is escaped as "<\/script>"
+    end = raw.find(SCRIPT_END, start)
+    try:
+        return raw[start:len(raw) if end < 0 else end].decode()
+    except UnicodeDecodeError as error:
+        raise StateExtractError(f"Initial state is not UTF-8: {error}") from None
+
+
+def extract_state(raw: bytes, keys: tuple = None) -> dict:
+    '''
+    Initial state from raw page bytes. With ``keys`` only these
+    top level members are returned, missing ones raise ``StateExtractError``
+    '''
+    text = _state_text(raw)
+    if keys is None:
+        try:
+            return _DECODER.raw_decode(text)[0]
+        except ValueError as error:
+            raise StateExtractError(f"Broken initial state: {error}") from None
+    state = dict()
+    pos = 1
+    while True:
+        pos = _WHITESPACE.match(text, pos).end()
+        if text[pos:pos + 1] == "}":
+            break
+        key = _KEY.match(text, pos)
+        if key is None:
+            raise StateExtractError(f"Expected member name at {pos} of initial state")
+        try:
+            (value, pos) = _DECODER.scan_once(text, key.end())
+        except (StopIteration, ValueError):
+            raise StateExtractError(f"Broken '{key.group(1)}' in initial state") from None
+        if key.group(1) in keys:
+            state[key.group(1)] = value
+            if len(state) == len(keys):
+                return state
+        pos = _WHITESPACE.match(text, pos).end()
+        if text[pos:pos + 1] == ",":
+            pos += 1
+        elif text[pos:pos + 1] != "}":
+            raise StateExtractError(f"Expected ',' or '}}' at {pos} of initial state")
+    missing = [key for key in keys if key not in state]
+    raise StateExtractError(f"No {', '.join(missing)} in initial state")
+
+
+def extract_regex(raw: bytes) -> dict:
+    '''
+    Old extractor: regex over the whole decoded page
+    '''
+    return json.loads(re.findall(r"\{\"faculties\".+", raw.decode())[0][:-2])
+
+
+def main():
+    parser = ap.ArgumentParser(prog="RuzState",
+                               description="Compare initial state extractors on captured pages")
+    parser.add_argument("pages", nargs="*", help="Captured HTML pages, stub pages if none")
+    parser.add_argument("--key", action="append", help="Top level member to extract, all if none")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = list()
+        for path in args.pages:
+            with open(path, "rb") as f:
+                pages.append(f.read())
+    else:
+        from ruzstub import initial_state, render_page
+        pages = [render_page(initial_state(path)) for path in
+                 ("/search/groups?q=3530901", "/teachers/1234?date=2023-05-01",
+                  "/faculty/95/groups/35390?date=2023-05-01")]
+    # Member the scheduler needs from each page
+    keys = [tuple(args.key) if args.key else
+            tuple(key for key in STATE_KEYS if f'"{key}":'.encode() in page)[:1] for page in pages]
+    print(f"{len(pages)} pages, {sum(map(len, pages)) / len(pages) / 1024:.1f} KB on average")
+    extractors = [
+        ("regex", lambda raw, keys: extract_regex(raw)),
+        ("whole state", lambda raw, keys: extract_state(raw)),
+        ("needed members", extract_state),
+    ]
+    for (name, extractor) in extractors:
+        start = time.perf_counter()
+        failed = 0
+        for _ in range(args.repeat):
+            for (page, page_keys) in zip(pages, keys):
+                try:
+                    extractor(page, page_keys)
+                except (ValueError, IndexError):
+                    failed += 1
+        elapsed = (time.perf_counter() - start) / args.repeat / len(pages)
+        print(f"{name:16} {elapsed * 1e6:9.1f} us/page  {failed // args.repeat} pages failed")
+
+
+if __name__ == "__main__":
+    main()
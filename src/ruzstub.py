@@ -0,0 +1,251 @@
+import argparse as ap
+import gzip
+import hashlib
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import requests as req
+
+from pagecache import PageCache
+from scheduler import RequestSender, create_session, fetch_schedules
+
+'''
+Local stub of ruz.spbstu.ru pages used by scheduler and a latency
+benchmark of the HTTP client: bare ``requests.get``, pooled session
+and concurrent fetches
+'''
+
+
+def lesson(subject: str, day: int) -> dict:
+    return {
+        "subject": subject,
+        "time_start": f"{8 + 2 * day}:00",
+        "time_end": f"{9 + 2 * day}:30",
+        "typeObj": {"name": "Лекции"},
+        "additional_info": "",
+        "groups": [{"name": "3530901/00001", "level": 3, "faculty": {"abbr": "ИКНТ"}}],
+        "teachers": [{"full_name": "Иванов Иван Иванович"}],
+        "auditories": [{"name": "101", "building": {"name": "Главный учебный корпус"}}]
+    }
+
+
+def week(day: str) -> list:
+    monday = date.fromisoformat(day) - timedelta(days=date.fromisoformat(day).weekday())
+    return [{"weekday": weekday, "date": (monday + timedelta(days=weekday - 1)).isoformat(),
+             "lessons": [lesson(f"Предмет {weekday}", weekday)]} for weekday in range(1, 6)]
+
+
+# Every real page carries the list of faculties before the data of the page
+FACULTIES = [{"id": 90 + index, "name": f"Институт {index}", "abbr": f"И{index}"} for index in range(20)]
+
+
+def initial_state(path: str) -> dict | None:
+    '''
+    State of the page by its path with query, None for unknown pages
+    '''
+    url = urlparse(path)
+    parts = [unquote(part) for part in url.path.strip("/").split("/")]
+    query = parse_qs(url.query)
+    day = query.get("date", ["2023-05-01"])[0] or "2023-05-01"
+    state = {"faculties": {"data": FACULTIES}}
+    match parts:
+        case ["search", "groups"]:
+            name = query.get("q", [""])[0]
+            state["searchGroup"] = {"data": [{"id": abs(hash(name)) % 10**5, "faculty": {"id": 95}}]}
+        case ["search", "teacher"]:
+            name = query.get("q", [""])[0]
+            state["searchTeacher"] = {"data": [{"id": abs(hash(name)) % 10**5}]}
+        case ["teachers", teacher_id]:
+            state["teacherSchedule"] = {"data": {teacher_id: week(day)}}
+        case ["faculty", faculty_id, "groups", group_id]:
+            state["lessons"] = {"data": {group_id: week(day)}}
+        case _:
+            return None
+    state["groups"] = {"data": {}}
+    return state
+
+
+BUILDINGS = [{"id": 1, "name": "Главный учебный корпус", "abbr": "ГУК", "address": "Политехническая, 29"},
+             {"id": 2, "name": "Научно-исследовательский корпус", "abbr": "НИК", "address": "Политехническая, 29"},
+             {"id": 3, "name": "Учебный корпус 1", "abbr": "1 к.", "address": "Политехническая, 29"}]
+
+
+def api_data(path: str) -> dict | None:
+    '''
+    Answer of ``api/v1/ruz/buildings`` endpoints, None for unknown ones
+    '''
+    url = urlparse(path)
+    parts = url.path.strip("/").split("/")
+    day = parse_qs(url.query).get("date", ["2023-05-01"])[0] or "2023-05-01"
+    match parts:
+        case ["api", "v1", "ruz", "buildings"]:
+            return {"buildings": BUILDINGS}
+        case ["api", "v1", "ruz", "buildings", building_id, "rooms"]:
+            rooms = [{"id": int(building_id) * 1000 + index, "name": f"{100 * int(building_id) + index}"}
+                     for index in range(1, 40)]
+            return {"building": BUILDINGS[int(building_id) - 1], "rooms": rooms}
+        case ["api", "v1", "ruz", "buildings", building_id, "rooms", room_id, "scheduler"]:
+            return {"room": {"id": int(room_id)}, "days": week(day)}
+    return None
+
+
+def render_page(state: dict) -> bytes:
+    # Same layout as the real page: state object on one line of a script
+    return f"<html><script>\nwindow.__INITIAL_STATE__ = {json.dumps(state)};\r\n</script></html>".encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        # Headers and body are written separately, without this kept alive connections stall on delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self) -> None:
+        with self.server.lock:
+            self.server.requests += 1
+            failure = self.server.fail_next > 0
+            if failure:
+                self.server.fail_next -= 1
+        time.sleep(self.server.delay())
+        if failure:
+            self.answer(503, b"")
+            return
+        found = self.page()
+        if found is None:
+            self.answer(404, b"Not found")
+            return
+        (page, content_type) = found
+        etag = f'"{hashlib.md5(page).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.answer(304, b"", etag)
+            return
+        self.answer(200, page, etag, content_type)
+
+    def page(self) -> tuple | None:
+        '''
+        Body and content type of the requested path, None for unknown pages
+        '''
+        if self.path.startswith("/api/"):
+            data = api_data(self.path)
+            return None if data is None else (json.dumps(data).encode(), "application/json")
+        state = initial_state(self.path)
+        return None if state is None else (render_page(state), "text/html; charset=utf-8")
+
+    def answer(self, status: int, body: bytes, etag: str = None,
+               content_type: str = "text/html; charset=utf-8") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if etag:
+            self.send_header("ETag", etag)
+        if body and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubRuz(ThreadingHTTPServer):
+    '''
+    Stub schedule site on ``127.0.0.1:port``. Counts requests and
+    opened connections, ``latency`` plus up to ``jitter`` seconds is
+    added to every answer and ``fail_next`` answers are 503
+    '''
+    daemon_threads = True
+    handler = StubHandler
+
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.0) -> None:
+        super().__init__(("127.0.0.1", port), self.handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.fail_next = 0
+        threading.Thread(target=self.serve_forever, name="StubRuz", daemon=True).start()
+
+    def delay(self) -> float:
+        return self.latency + random.uniform(0, self.jitter) if self.jitter else self.latency
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset(self) -> None:
+        with self.lock:
+            (self.requests, self.connections) = (0, 0)
+
+
+def benchmark(stub: StubRuz, queries: list, workers: int) -> None:
+    def sequential(session) -> list:
+        results = list()
+        for (mode, name, date) in queries:
+            if mode == "teacher":
+                results.append(RequestSender(name, None, date, None, session, stub.url).get_teacher_schedule())
+            else:
+                results.append(RequestSender(None, name, date, None, session, stub.url).get_group_schedule())
+        return results
+
+    session = create_session(workers)
+    cache = PageCache(os.path.join(tempfile.mkdtemp(), "cache.sqlite3"))
+    runs = [
+        ("bare requests.get", lambda: sequential(req)),
+        ("pooled session", lambda: sequential(create_session())),
+        (f"concurrent x{workers}", lambda: fetch_schedules(queries, workers, session, stub.url)),
+        ("cache cold", lambda: fetch_schedules(queries, workers, session, stub.url, cache)),
+        ("cache warm", lambda: fetch_schedules(queries, workers, session, stub.url, cache)),
+        ("cache revalidate", lambda: fetch_schedules(queries, workers, session, stub.url, cache, refresh=True))
+    ]
+    for (name, run) in runs:
+        stub.reset()
+        start = time.perf_counter()
+        results = run()
+        elapsed = time.perf_counter() - start
+        errors = sum(isinstance(result, Exception) for result in results)
+        print(f"{name:20} {elapsed:7.3f} s  {len(queries) / elapsed:7.1f} queries/s  "
+              f"{stub.requests} requests  {stub.connections} connections  {errors} errors")
+
+    print(f"Cache: {cache.get_stats()}")
+    stub.reset()
+    stub.fail_next = 2
+    result = RequestSender("Иванов Иван Иванович", None, "01.05.2023", None,
+                           create_session(backoff=0.01), stub.url).get_teacher_schedule()
+    print(f"Retries: {len(result)} days after 2 failed answers, {stub.requests} requests")
+
+
+def main():
+    parser = ap.ArgumentParser(prog="RuzStub",
+                               description="Stub schedule server and HTTP client latency benchmark")
+    parser.add_argument("--queries", type=int, default=50, help="Schedule queries, half teachers, half groups")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every answer")
+    parser.add_argument("--workers", type=int, default=16, help="Threads of concurrent fetch")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="Only run stub server on the port")
+    args = parser.parse_args()
+
+    stub = StubRuz(args.serve or 0, args.latency)
+    if args.serve:
+        print(f"Stub schedule site on {stub.url}")
+        threading.Event().wait()
+    queries = [("teacher" if index % 2 else "group", f"name {index}", f"{index % 28 + 1:02d}.05.2023")
+               for index in range(args.queries)]
+    benchmark(stub, queries, args.workers)
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,75 @@
 import argparse as arg
 import json
 import os
-import re
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from urllib.parse import quote
 
-import matplotlib.pyplot as plt
 import requests as req
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from pagecache import PageCache
+from placeindex import PlaceIndex
+from ruzstate import extract_state
+from schedulerender import RENDERERS, WEEKDAYS, ChartRenderer, Lesson, buffered_stream, extract_lessons
+from schedulestore import STORE_PATH, ScheduleStore, week_of
+
+BASE_URL = "https://ruz.spbstu.ru"
+TIMEOUT = (5, 30)  # Connect and read timeouts, seconds
+POOL_SIZE = 16  # Kept alive connections and threads of fetch_schedules
+RETRIES = 3
+BACKOFF = 0.5  # Retry after 0.5, 1, 2... seconds
+CACHE_PATH = "cache/ruz.sqlite3"
+CACHE_SIZE = 64 * 2**20  # Bytes of cached pages on disk
+LOOKUP_TTL = 7 * 24 * 3600  # Group and teacher ids almost never change
+SCHEDULE_TTL = 3600  # Weekly schedule, revalidated after it
+PLACES_NAME = "places.json"  # Buildings and rooms index, kept next to the page cache
+PLACES_TTL = 30 * 24 * 3600
+MODES = {1: "teacher", 2: "group", 3: "place"}
+_PLACES = dict()
+_PLACES_LOADING = dict()
+_PLACES_LOCK = threading.Lock()
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def create_session(pool_size: int = POOL_SIZE, retries: int = RETRIES, backoff: float = BACKOFF) -> req.Session:
+    '''
+    Session with pool of kept alive connections. Connection errors,
+    429 and 5xx answers are retried with exponential backoff
+    '''
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = req.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    return session
+
+
+def default_session() -> req.Session:
+    '''
+    Session shared by all senders of the process
+    '''
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = create_session()
+        return _SESSION
+
+
+def reset_places() -> None:
+    '''
+    Forget buildings and rooms kept in memory, the next lookup loads them again
+    '''
+    with _PLACES_LOCK:
+        _PLACES.clear()
 
 
 class ScheduleFindError(Exception):
@@ -29,16 +93,71 @@ class RequestSender:
     timetable by parameters in raw form
     '''
 
-    def __init__(self, teacher_name: str, group_id: str, date: str, place: str) -> None:
+    def __init__(self, teacher_name: str, group_id: str, date: str, place: str,
+                 session: req.Session = None, base_url: str = BASE_URL, timeout: tuple = TIMEOUT,
+                 cache: PageCache = None, refresh: bool = False) -> None:
         self.ENDPOINTS = {
-            "group": "https://ruz.spbstu.ru/search/groups?q=",
-            "teacher": "https://ruz.spbstu.ru/search/teacher?q=",
-            "teacher_schedule": "https://ruz.spbstu.ru/teachers/"
+            "group": f"{base_url}/search/groups?q=",
+            "teacher": f"{base_url}/search/teacher?q=",
+            "teacher_schedule": f"{base_url}/teachers/",
+            "group_schedule": f"{base_url}/faculty/",
+            "buildings": f"{base_url}/api/v1/ruz/buildings"
         }
         self.teacher_name = teacher_name
         self.group_id = group_id
         self.date = date
         self.place = place
+        # ``requests`` module itself works too, without pooling
+        self.session = session or default_session()
+        self.timeout = timeout
+        self.cache = cache
+        self.refresh = refresh
+
+    def get(self, url: str, headers: dict = None) -> req.Response:
+        '''
+        GET through the pooled session, HTTP errors are raised
+        '''
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def fetch_state(self, url: str, ttl: float, key: str) -> dict:
+        '''
+        ``key`` member of the page initial state. Cached one younger than ``ttl`` seconds
+        is used without request, older one is revalidated by ETag or
+        Last-Modified. ``refresh`` revalidates regardless of age
+        '''
+        # Only the needed member is kept, so cached pages are not parsed again
+        return self._fetch_cached(url, ttl, lambda response: extract_state(response.content, (key,)))
+
+    def fetch_json(self, url: str, ttl: float) -> dict:
+        '''
+        JSON API answer, cached like ``fetch_state``
+        '''
+        return self._fetch_cached(url, ttl, lambda response: response.json())
+
+    def _fetch_cached(self, url: str, ttl: float, parse) -> dict:
+        if self.cache is None:
+            return parse(self.get(url))
+        entry = self.cache.get(url)
+        if entry is not None and not self.refresh and time.time() - entry.fetched < ttl:
+            self.cache.count("hits")
+            return json.loads(entry.value)
+        headers = dict()
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        response = self.get(url, headers)
+        if response.status_code == 304 and entry is not None:
+            self.cache.count("revalidated")
+            self.cache.touch(url)
+            return json.loads(entry.value)
+        self.cache.count("misses")
+        state = parse(response)
+        self.cache.put(url, json.dumps(state, ensure_ascii=False),
+                       response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return state
 
     def date_format(self) -> str:
         '''
@@ -56,9 +175,8 @@ class RequestSender:
         Important! The id of the faculty is a necessary parameter,\n
         because it participates in the formation of the link in the query
         '''
-        response = req.get(
-            self.ENDPOINTS['group'] + quote(self.group_id, safe=''))
-        data = self.extract_initial_state(response)
+        data = self.fetch_state(
+            self.ENDPOINTS['group'] + quote(self.group_id, safe=''), LOOKUP_TTL, "searchGroup")
         if len(data["searchGroup"]["data"]) == 1:
             return (
                 data["searchGroup"]["data"][0]["faculty"]["id"],
@@ -71,50 +189,303 @@ class RequestSender:
         '''
         Finding a teacher's id by FULL NAME (last name, first name, patronymic)
         '''
-        resp = req.get(self.ENDPOINTS['teacher'] +
-                       quote(self.teacher_name, safe=''))
-        data = self.extract_initial_state(resp)
+        data = self.fetch_state(self.ENDPOINTS['teacher'] +
+                                quote(self.teacher_name, safe=''), LOOKUP_TTL, "searchTeacher")
         if len(data['searchTeacher']['data']) == 1:
             return data['searchTeacher']['data'][0]['id']
         else:
             return -1
 
+    def place_index(self) -> PlaceIndex:
+        '''
+        Buildings and rooms of the site, fetched from ``api/v1/ruz/buildings``
+        once in ``PLACES_TTL`` and kept in memory, and on disk next to the
+        page cache when there is one. ``refresh`` skips the disk copy,
+        the index loaded by the process is kept until ``reset_places``
+        '''
+        url = self.ENDPOINTS['buildings']
+        with _PLACES_LOCK:
+            # Concurrent queries wait for one load instead of fetching the index each
+            loading = _PLACES_LOADING.setdefault(url, threading.Lock())
+        with loading:
+            with _PLACES_LOCK:
+                index = _PLACES.get(url)
+            if index is not None and time.time() - index.fetched < PLACES_TTL:
+                return index
+            path = None
+            if self.cache is not None:
+                name = PLACES_NAME if url.startswith(BASE_URL) else f"{PLACES_NAME}.{quote(url, safe='')}"
+                path = os.path.join(os.path.dirname(self.cache.path), name)
+            index = None if self.refresh or path is None else PlaceIndex.load(path, PLACES_TTL)
+            if index is None:
+                buildings = self.get(url).json()['buildings']
+                with ThreadPoolExecutor(max_workers=POOL_SIZE) as executor:
+                    rooms = executor.map(lambda building: self.get(f"{url}/{building['id']}/rooms").json()['rooms'],
+                                         buildings)
+                    for (building, building_rooms) in zip(buildings, rooms):
+                        building['rooms'] = [{"id": room['id'], "name": room['name']} for room in building_rooms]
+                index = PlaceIndex(buildings)
+                if path is not None:
+                    index.save(path)
+            with _PLACES_LOCK:
+                _PLACES[url] = index
+        return index
+
     def find_place(self) -> tuple:
         '''
-        Optional task. Use ``api/v1/ruz/buildings`` for json
+        Building and room ids by room number, optionally after building
+        name or abbreviation: ``101``, ``ГУК 101``, ``Главный учебный корпус, 101``
         '''
-        pass
+        (building, separator, room) = self.place.rpartition(",")
+        if not separator:
+            (building, separator, room) = self.place.strip().rpartition(" ")
+        found = self.place_index().find_rooms(room.strip(), building.strip() or None)
+        if len(found) == 1:
+            return (found[0][0]['id'], found[0][1]['id'])
+        else:
+            return (-1, -1)
 
     def extract_initial_state(self, data: req.Response) -> dict:
         '''
         Extract all data from HTML response
         '''
-        return json.loads(re.findall(r"\{\"faculties\".+", data.text)[0][:-2])
+        return extract_state(data.content)
 
-    def get_teacher_schedule(self) -> dict:
+    def get_teacher_schedule(self, teacher_id: int = None) -> dict:
         '''
-        Get a raw teacher's schedule by his own id
+        Get a raw teacher's schedule by his own id, it is found by name if not given
         '''
-        teacher_id = self.find_teacher()
+        if teacher_id is None:
+            teacher_id = self.find_teacher()
         if teacher_id == -1:
             raise ScheduleFindError
-        resp = req.get(self.ENDPOINTS['teacher_schedule'] +
-                       str(teacher_id) + "?date=" + self.date_format())
-        data = self.extract_initial_state(resp)
+        data = self.fetch_state(self.ENDPOINTS['teacher_schedule'] +
+                                str(teacher_id) + "?date=" + self.date_format(), SCHEDULE_TTL,
+                                "teacherSchedule")
         return data['teacherSchedule']['data'][str(teacher_id)]
 
-    def get_group_schedule(self) -> dict:
+    def get_group_schedule(self, g_info: tuple = None) -> dict:
         '''
-        Get a raw group's schedule by his own id
+        Get a raw group's schedule by his own id, ``(faculty id, group id)``
+        are found by name if not given
         '''
-        g_info = self.find_group()
+        if g_info is None:
+            g_info = self.find_group()
         if g_info[1] == -1:
             raise ScheduleFindError
-        resp = req.get(
-            f"https://ruz.spbstu.ru/faculty/{g_info[0]}/groups/{g_info[1]}?date={self.date_format()}")
-        data = self.extract_initial_state(resp)
+        data = self.fetch_state(
+            f"{self.ENDPOINTS['group_schedule']}{g_info[0]}/groups/{g_info[1]}?date={self.date_format()}",
+            SCHEDULE_TTL, "lessons")
         return data['lessons']['data'][str(g_info[1])]
 
+    def get_place_schedule(self, place: tuple = None) -> list:
+        '''
+        Get a raw room's schedule, ``(building id, room id)`` are found
+        by ``place`` if not given
+        '''
+        if place is None:
+            place = self.find_place()
+        if place[1] == -1:
+            raise ScheduleFindError
+        data = self.fetch_json(
+            f"{self.ENDPOINTS['buildings']}/{place[0]}/rooms/{place[1]}/scheduler?date={self.date_format()}",
+            SCHEDULE_TTL)
+        return data['days']
+
+    def find(self, kind: str):
+        '''
+        Id of the teacher, group or place, -1 or (-1, -1) if not found
+        '''
+        return {"teacher": self.find_teacher, "group": self.find_group, "place": self.find_place}[kind]()
+
+    def get_schedule(self, kind: str, found=None) -> list:
+        '''
+        Raw schedule of the teacher, group or place by id from ``find``
+        '''
+        match kind:
+            case "teacher":
+                return self.get_teacher_schedule(found)
+            case "group":
+                return self.get_group_schedule(found)
+            case "place":
+                return self.get_place_schedule(found)
+
+
+def fetch_schedules(queries: list, workers: int = POOL_SIZE, session: req.Session = None,
+                    base_url: str = BASE_URL, cache: PageCache = None, refresh: bool = False) -> list:
+    '''
+    Raw schedules for many ``(mode, name, date)`` queries, mode is
+    ``teacher``, ``group`` or ``place``. Lookups and schedule requests of different
+    queries run in parallel threads sharing one connection pool.
+    Failed query gets its exception instead of schedule
+    '''
+    session = session or default_session()
+
+    def fetch(query: tuple):
+        (mode, name, date) = query
+        try:
+            return sender_for(mode, name, date, session=session, base_url=base_url,
+                              cache=cache, refresh=refresh).get_schedule(mode)
+        except Exception as error:
+            return error
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fetch, queries))
+
+
+def week_dates(first: str, last: str = None) -> list:
+    '''
+    One date of every week from ``first`` to ``last``, both are dd.mm.yyyy
+    '''
+    start = datetime.strptime(first, "%d.%m.%Y")
+    end = datetime.strptime(last, "%d.%m.%Y") if last else start
+    # Monday of every week, schedule is returned for the whole week of the date
+    monday = start - timedelta(days=start.weekday())
+    dates = list()
+    while monday <= end:
+        dates.append(max(monday, start).strftime("%d.%m.%Y"))
+        monday += timedelta(days=7)
+    return dates
+
+
+def sender_for(kind: str, name: str, date: str = None, **kwargs) -> RequestSender:
+    '''
+    Sender for ``teacher``, ``group`` or ``place`` by its name
+    '''
+    return RequestSender(teacher_name=name if kind == "teacher" else None,
+                         group_id=name if kind == "group" else None,
+                         date=date,
+                         place=name if kind == "place" else None,
+                         **kwargs)
+
+
+class BatchSchedule:
+    '''
+    Schedules of many teachers and groups over a range of weeks
+    in one run. Every name is looked up once, weeks are fetched by
+    at most ``workers`` threads and written as soon as they arrive
+    '''
+    FIELDS = Lesson._fields
+
+    def __init__(self, entries: list, dates: list, workers: int = POOL_SIZE, session: req.Session = None,
+                 base_url: str = BASE_URL, cache: PageCache = None, refresh: bool = False) -> None:
+        self.entries = list(dict.fromkeys(entries))
+        self.dates = dates
+        self.workers = workers
+        self.session = session or default_session()
+        self.base_url = base_url
+        self.cache = cache
+        self.refresh = refresh
+        self._lookups = dict()
+        self._lock = threading.Lock()
+        # Lessons by date of every name, for graphs
+        self.counts = dict()
+
+    def _sender(self, kind: str, name: str, date: str = None) -> RequestSender:
+        return sender_for(kind, name, date, session=self.session, base_url=self.base_url,
+                          cache=self.cache, refresh=self.refresh)
+
+    def _lookup(self, kind: str, name: str):
+        '''
+        Id of the name, found once for all its weeks
+        '''
+        with self._lock:
+            future = self._lookups.get((kind, name))
+            owner = future is None
+            if owner:
+                future = self._lookups[(kind, name)] = Future()
+        if owner:
+            try:
+                future.set_result(self._sender(kind, name).find(kind))
+            except BaseException as error:
+                future.set_exception(error)
+        return future.result()
+
+    def _fetch(self, kind: str, name: str, date: str) -> list:
+        found = self._lookup(kind, name)
+        if found in (-1, (-1, -1)):
+            raise ScheduleFindError
+        return self._sender(kind, name, date).get_schedule(kind, found)
+
+    def run(self, write) -> dict:
+        '''
+        Fetch everything, ``write(kind, name, date, days, error)`` is
+        called from this thread in order of completion. Returns totals
+        '''
+        totals = {"weeks": 0, "lessons": 0, "errors": 0}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._fetch, kind, name, date): (kind, name, date)
+                       for (kind, name) in self.entries for date in self.dates}
+            for future in as_completed(futures):
+                (kind, name, date) = futures[future]
+                error = future.exception()
+                days = None if error else future.result()
+                write(kind, name, date, days, error)
+                if error:
+                    totals["errors"] += 1
+                    continue
+                totals["weeks"] += 1
+                counts = self.counts.setdefault((kind, name), dict())
+                for day in days:
+                    counts[day['date']] = counts.get(day['date'], 0) + len(day['lessons'])
+                    totals["lessons"] += len(day['lessons'])
+        return totals
+
+    def draw_graphs(self, folder: str = "result") -> list:
+        '''
+        One chart for every name, after all weeks are fetched. Charts
+        are drawn in batches by the chart worker process
+        '''
+        charts = ChartRenderer()
+        for ((kind, name), counts) in self.counts.items():
+            if not counts:
+                continue
+            counts = dict(sorted(counts.items()))
+            first = next(iter(counts))[5:]
+            charts.add(counts, f"{name}: количество занятий с {first}",
+                       f"{folder}/schedule_{name.replace('/', '_').replace(' ', '_')}_{first}.png")
+        return charts.close()
+
+
+def read_entries(path: str, default_kind: str) -> list:
+    '''
+    Names from file or stdin (``-``), one per line, optionally
+    prefixed with ``teacher:``, ``group:`` or ``place:``
+    '''
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    entries = list()
+    with stream:
+        for line in stream:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            (kind, separator, name) = line.partition(":")
+            if separator and kind.strip() in MODES.values():
+                entries.append((kind.strip(), name.strip()))
+            else:
+                entries.append((default_kind, line))
+    return entries
+
+
+def batch_writer(stream, output_format: str):
+    '''
+    ``write`` callback of ``BatchSchedule.run`` for text, JSON Lines or CSV.
+    Every week is flushed, so results can be read while the batch runs
+    '''
+    renderer = RENDERERS[output_format](stream)
+
+    def write(kind: str, name: str, date: str, days: list, error: BaseException) -> None:
+        if error is None:
+            renderer.write(extract_lessons(kind, name, days))
+        elif hasattr(renderer, "error"):
+            renderer.error(kind, name, date, error)
+        else:
+            print(f"{kind} {name}, {date}: {error}", file=sys.stderr)
+        stream.flush()
+
+    write.close = renderer.close
+    return write
+
 
 class ParseSchedule(RequestSender):
     '''
@@ -126,100 +497,111 @@ class ParseSchedule(RequestSender):
         super().__init__(teacher_name=args.t,
                          group_id=args.g,
                          date=args.d,
-                         place=args.a)
-        self.WEEKDAYS = {
-            1: "Понедельник",
-            2: "Вторник",
-            3: "Среда",
-            4: "Четверг",
-            5: "Пятница",
-            6: "Суббота",
-            7: "Воскресенье"
-        }
-        self.mode = 'teacher' if args.m == 1 else 'group'
+                         place=args.a,
+                         base_url=args.url,
+                         cache=None if args.no_cache else PageCache(CACHE_PATH, CACHE_SIZE),
+                         refresh=args.refresh)
+        self.WEEKDAYS = WEEKDAYS
+        self.mode = MODES[args.m]
 
-    def print_schedule(self) -> dict:
+    def print_schedule(self, output_format: str = "text", stream=None) -> dict:
         '''
         Beautiful output of the schedule
         according to the selected mode of the script
         '''
+        name = {"teacher": self.teacher_name, "group": self.group_id, "place": self.place}[self.mode]
+        lessons = list(extract_lessons(self.mode, name, self.get_schedule(self.mode)))
+        stream = stream or buffered_stream()
+        renderer = RENDERERS[output_format](stream)
+        renderer.write(lessons)
+        renderer.close()
         graph_info = dict()
-        match self.mode:
-            case 'teacher':
-                print(self.teacher_name)
-                raw_schedule = self.get_teacher_schedule()
-                for day in raw_schedule:
-                    print(
-                        f"======== {self.WEEKDAYS[day['weekday']]} ========\n")
-                    for lesson in day['lessons']:
-                        try:
-                            graph_info[day['date']] += 1
-                        except KeyError:
-                            graph_info[day['date']] = 1
-                        print(
-                            f"{lesson['time_start']} - {lesson['time_end']}:")
-                        print(f"    {lesson['subject']}")
-                        print(f"    {lesson['typeObj']['name']}")
-                        if lesson['additional_info'] == "Поток":
-                            print(
-                                f"    Поток, {lesson['groups'][0]['level']} курс {lesson['groups'][0]['faculty']['abbr']}")
-                        else:
-                            print(f"    Группа {lesson['groups'][0]['name']}")
-                        print(
-                            f"    Аудитория {lesson['auditories'][0]['name']}, {lesson['auditories'][0]['building']['name']}")
-                    print("\n")
-            case 'group':
-                print(self.group_id)
-                raw_schedule = self.get_group_schedule()
-                for day in raw_schedule:
-                    print(
-                        f"======== {self.WEEKDAYS[day['weekday']]} ========\n")
-                    for lesson in day['lessons']:
-                        try:
-                            graph_info[day['date']] += 1
-                        except KeyError:
-                            graph_info[day['date']] = 1
-                        print(
-                            f"{lesson['time_start']} - {lesson['time_end']}:")
-                        print(f"    {lesson['subject']}")
-                        print(f"    {lesson['typeObj']['name']}")
-                        if (lesson['teachers']):
-                            print(f"    {lesson['teachers'][0]['full_name']}")
-                        print(
-                            f"    Аудитория {lesson['auditories'][0]['name']}, {lesson['auditories'][0]['building']['name']}")
-                    print("\n")
+        for lesson in lessons:
+            graph_info[lesson.date] = graph_info.get(lesson.date, 0) + 1
         return graph_info
 
-    def draw_graph(self) -> None:
+    def draw_graph(self, output_format: str = "text", graph: bool = True) -> None:
         '''
         Prepare data from raw schedule and draw the bar
         thanks by modified dates and counts
         '''
-        data = self.print_schedule()
-        count_of_subjects = list(data.values())
-        dates = [raw_date[5:] for raw_date in list(data.keys())]
-        plt.bar(dates, count_of_subjects, width=0.4)
-        plt.title(f"Количество занятий каждый день с {dates[0]}")
-        plt.autoscale(enable=True)
-        plt.xlabel("День недели")
-        plt.ylabel("Количество занятий")
-        os.makedirs('result') if not os.path.exists('result') else None
-        plt.savefig(f'result/schedule_{dates[0]}.png')
+        data = self.print_schedule(output_format)
+        if not graph or not data:
+            return
+        first = list(data.keys())[0][5:]
+        charts = ChartRenderer()
+        charts.add(data, f"Количество занятий каждый день с {first}", f'result/schedule_{first}.png')
+        charts.close()
 
 
 def main():
     parser = arg.ArgumentParser(prog="Polytech Python Schedule",
                                 description="A Python script to parse Polytech schedule by teacher name or group id")
     parser.add_argument(
-        "-m", type=int, help="Select mode to work: 1 - work with teacher name, 2 - parse by group id", choices=[1, 2], required=True)
+        "-m", type=int, help="Select mode to work: 1 - work with teacher name, 2 - parse by group id, 3 - room occupancy by place",
+        choices=[1, 2, 3], required=True)
     parser.add_argument("-t", type=str, help="Teacher name")
     parser.add_argument("-g", type=str, help="University group ID")
     parser.add_argument("-d", type=str, help="The date you are interested in")
-    parser.add_argument("-a", type=str, help="The number of place")
+    parser.add_argument("-a", type=str, help="The number of place, optionally after building: 'ГУК, 101'")
+    parser.add_argument("--url", type=str, default=BASE_URL, help="Schedule site, e.g. local stub server")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use cache of pages")
+    parser.add_argument("--refresh", action="store_true", help="Revalidate cached pages regardless of their age")
+    parser.add_argument("-b", type=str, metavar="FILE",
+                        help="Batch mode: names from file or - for stdin, one per line, "
+                             "'teacher:' or 'group:' prefix overrides -m")
+    parser.add_argument("--to", type=str, help="Batch mode: last date of the range, -d is the first")
+    parser.add_argument("-o", type=str, default="-", help="Batch mode: output file, - for stdout")
+    parser.add_argument("--format", choices=list(RENDERERS),
+                        help="Output format, text by default, in batch mode by -o extension or jsonl")
+    parser.add_argument("--workers", type=int, default=POOL_SIZE, help="Batch mode: concurrent requests")
+    parser.add_argument("--no-graph", action="store_true", help="Do not draw graphs")
+    parser.add_argument("--store", type=str, nargs="?", const=STORE_PATH,
+                        help="Batch mode: also save lessons to schedule store for schedulestore.py queries")
 
     args = parser.parse_args()
+    if args.b:
+        run_batch(args)
+        return
     schedule = ParseSchedule(args=args)
-    schedule.draw_graph()
+    schedule.draw_graph(args.format or "text", graph=not args.no_graph)
+
+
+def run_batch(args: arg.Namespace) -> None:
+    if not args.d:
+        raise SystemExit("Batch mode needs -d, the first date of the range")
+    entries = read_entries(args.b, MODES[args.m])
+    output_format = args.format or ("csv" if args.o.endswith(".csv") else "jsonl")
+    batch = BatchSchedule(entries, week_dates(args.d, args.to), workers=args.workers,
+                          session=create_session(args.workers), base_url=args.url,
+                          cache=None if args.no_cache else PageCache(CACHE_PATH, CACHE_SIZE),
+                          refresh=args.refresh)
+    stream = buffered_stream(args.o)
+    write = batch_writer(stream, output_format)
+    store = ScheduleStore(args.store) if args.store else None
+    changed = 0
+
+    def write_and_store(kind: str, name: str, date: str, days: list, error: BaseException) -> None:
+        nonlocal changed
+        write(kind, name, date, days, error)
+        if store is not None and error is None:
+            week = week_of(datetime.strptime(date, "%d.%m.%Y").date().isoformat())
+            changed += store.ingest_week(kind, name, days, week)
+
+    start = time.perf_counter()
+    try:
+        totals = batch.run(write_and_store)
+        write.close()
+    finally:
+        stream.close()
+        if store is not None:
+            store.close()
+    if store is not None:
+        print(f"{changed} weeks changed in {args.store}", file=sys.stderr)
+    print(f"{len(batch.entries)} names, {totals['weeks']} weeks, {totals['lessons']} lessons, "
+          f"{totals['errors']} errors in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    if not args.no_graph:
+        batch.draw_graphs()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,252 @@
+import argparse as ap
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+'''
+Schedule output: raw days are turned into ``Lesson`` records in one
+pass, renderers write records as text, JSON Lines or CSV. Charts are
+drawn in a worker process, matplotlib is never imported here
+'''
+Lesson = namedtuple("Lesson", ["kind", "name", "date", "weekday", "time_start", "time_end", "subject",
+                               "type", "teachers", "groups", "stream", "auditory", "building"])
+WEEKDAYS = {
+    1: "Понедельник",
+    2: "Вторник",
+    3: "Среда",
+    4: "Четверг",
+    5: "Пятница",
+    6: "Суббота",
+    7: "Воскресенье"
+}
+
+
+def extract_lessons(kind: str, name: str, days: list):
+    '''
+    ``Lesson`` records of raw schedule days
+    '''
+    for day in days:
+        for lesson in day['lessons']:
+            groups = lesson.get('groups') or ()
+            auditories = lesson.get('auditories') or ({"name": "", "building": {"name": ""}},)
+            stream = ""
+            if lesson.get('additional_info') == "Поток" and groups:
+                stream = f"{groups[0]['level']} курс {groups[0]['faculty']['abbr']}"
+            yield Lesson(kind, name, day['date'], day['weekday'], lesson['time_start'], lesson['time_end'],
+                         lesson['subject'], lesson['typeObj']['name'],
+                         tuple(teacher['full_name'] for teacher in lesson.get('teachers') or ()),
+                         tuple(group['name'] for group in groups), stream,
+                         auditories[0]['name'], auditories[0]['building']['name'])
+
+
+def buffered_stream(path: str = "-", buffer_size: int = 1 << 16) -> io.TextIOBase:
+    '''
+    One buffered text writer for renderers, ``-`` is stdout
+    '''
+    sys.stdout.flush()
+    return open(sys.stdout.fileno() if path == "-" else path, "w", encoding="utf-8", newline="",
+                buffering=buffer_size, closefd=path != "-")
+
+
+class TextRenderer:
+    '''
+    Human readable schedule, name and weekday headers are written
+    when they change
+    '''
+
+    def __init__(self, stream: io.TextIOBase) -> None:
+        self.stream = stream
+        self._name = None
+        self._date = None
+
+    def write(self, lessons) -> int:
+        lines = list()
+        count = 0
+        for lesson in lessons:
+            count += 1
+            if lesson.name != self._name:
+                if self._date is not None:
+                    lines.append("\n\n")
+                lines.append(f"{lesson.name}\n")
+                (self._name, self._date) = (lesson.name, None)
+            if lesson.date != self._date:
+                if self._date is not None:
+                    lines.append("\n\n")
+                lines.append(f"======== {WEEKDAYS[lesson.weekday]} ========\n\n")
+                self._date = lesson.date
+            lines.append(f"{lesson.time_start} - {lesson.time_end}:\n    {lesson.subject}\n    {lesson.type}\n")
+            match lesson.kind:
+                case "teacher":
+                    if lesson.stream:
+                        lines.append(f"    Поток, {lesson.stream}\n")
+                    elif lesson.groups:
+                        lines.append(f"    Группа {lesson.groups[0]}\n")
+                    lines.append(f"    Аудитория {lesson.auditory}, {lesson.building}\n")
+                case "group":
+                    if lesson.teachers:
+                        lines.append(f"    {lesson.teachers[0]}\n")
+                    lines.append(f"    Аудитория {lesson.auditory}, {lesson.building}\n")
+                case "place":
+                    if lesson.teachers:
+                        lines.append(f"    {lesson.teachers[0]}\n")
+                    lines.append(f"    Группа {', '.join(lesson.groups)}\n")
+        self.stream.write("".join(lines))
+        return count
+
+    def close(self) -> None:
+        if self._date is not None:
+            self.stream.write("\n\n")
+        self.stream.flush()
+
+
+class JsonLinesRenderer:
+    '''
+    One JSON object per lesson
+    '''
+
+    def __init__(self, stream: io.TextIOBase) -> None:
+        self.stream = stream
+
+    def write(self, lessons) -> int:
+        lines = [json.dumps(lesson._asdict(), ensure_ascii=False) + "\n" for lesson in lessons]
+        self.stream.write("".join(lines))
+        return len(lines)
+
+    def error(self, kind: str, name: str, date: str, error: BaseException) -> None:
+        self.stream.write(json.dumps({"kind": kind, "name": name, "date": date, "error": str(error)},
+                                     ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        self.stream.flush()
+
+
+class CsvRenderer:
+    '''
+    CSV with ``Lesson`` fields as header, teachers and groups joined by "; "
+    '''
+
+    def __init__(self, stream: io.TextIOBase) -> None:
+        self.stream = stream
+        self._writer = csv.writer(stream)
+        self._writer.writerow(Lesson._fields)
+
+    def write(self, lessons) -> int:
+        rows = [lesson._replace(teachers="; ".join(lesson.teachers), groups="; ".join(lesson.groups))
+                for lesson in lessons]
+        self._writer.writerows(rows)
+        return len(rows)
+
+    def close(self) -> None:
+        self.stream.flush()
+
+
+RENDERERS = {
+    "text": TextRenderer,
+    "jsonl": JsonLinesRenderer,
+    "csv": CsvRenderer
+}
+
+
+def draw_charts(charts: list) -> list:
+    '''
+    Bar charts of lessons count by date, ``(counts, title, path)``
+    each. Runs in the chart worker process
+    '''
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    for (counts, title, path) in charts:
+        dates = [raw_date[5:] for raw_date in counts]
+        plt.figure()
+        plt.bar(dates, list(counts.values()), width=0.4)
+        plt.title(title)
+        plt.autoscale(enable=True)
+        plt.xlabel("День недели")
+        plt.ylabel("Количество занятий")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        plt.savefig(path)
+        plt.close()
+    return [path for (counts, title, path) in charts]
+
+
+class ChartRenderer:
+    '''
+    Collects charts and draws them in one worker process,
+    ``batch_size`` charts per job. The process is started with
+    the first batch, so runs without charts never load matplotlib
+    '''
+
+    def __init__(self, batch_size: int = 50) -> None:
+        self.batch_size = batch_size
+        self._pending = list()
+        self._jobs = list()
+        self._executor = None
+
+    def add(self, counts: dict, title: str, path: str) -> None:
+        self._pending.append((counts, title, path))
+        if len(self._pending) >= self.batch_size:
+            self._submit()
+
+    def _submit(self) -> None:
+        if not self._pending:
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"))
+        self._jobs.append(self._executor.submit(draw_charts, self._pending))
+        self._pending = list()
+
+    def close(self) -> list:
+        '''
+        Wait for all charts, returns their paths
+        '''
+        self._submit()
+        paths = list()
+        for job in self._jobs:
+            paths.extend(job.result())
+        if self._executor is not None:
+            self._executor.shutdown()
+        return paths
+
+
+def main():
+    parser = ap.ArgumentParser(prog="ScheduleRender",
+                               description="Throughput of schedule renderers in lessons per second")
+    parser.add_argument("--weeks", type=int, default=2000, help="Synthetic weeks to render")
+    parser.add_argument("--charts", type=int, default=0, help="Also draw this many charts")
+    args = parser.parse_args()
+
+    from ruzstub import week
+    weeks = [week("2023-05-01") for _ in range(args.weeks)]
+    start = time.perf_counter()
+    lessons = [lesson for (index, days) in enumerate(weeks) for lesson in extract_lessons("group", f"{index}", days)]
+    elapsed = time.perf_counter() - start
+    print(f"{'extract':8} {len(lessons) / elapsed:12.0f} lessons/s")
+    for (name, renderer) in RENDERERS.items():
+        with open(os.devnull, "w", encoding="utf-8", buffering=1 << 16) as stream:
+            start = time.perf_counter()
+            output = renderer(stream)
+            for index in range(0, len(lessons), 5):
+                output.write(lessons[index:index + 5])
+            output.close()
+            elapsed = time.perf_counter() - start
+        print(f"{name:8} {len(lessons) / elapsed:12.0f} lessons/s")
+    if args.charts:
+        charts = ChartRenderer()
+        start = time.perf_counter()
+        for index in range(args.charts):
+            charts.add({day['date']: len(day['lessons']) for day in weeks[index % len(weeks)]},
+                       f"Chart {index}", f"result/bench/chart_{index}.png")
+        charts.close()
+        print(f"{'charts':8} {args.charts / (time.perf_counter() - start):12.1f} charts/s")
+
+
+if __name__ == "__main__":
+    main()
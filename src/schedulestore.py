@@ -0,0 +1,298 @@
+import argparse as ap
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+'''
+Normalized store of fetched lessons with indexes for queries
+over rooms, teachers and groups. Lesson seen in schedules of
+several groups and its teacher is stored once
+'''
+STORE_PATH = "cache/schedule.sqlite3"
+
+
+def week_of(day: str) -> str:
+    '''
+    Monday of the week of ``yyyy-mm-dd`` date
+    '''
+    value = date.fromisoformat(day)
+    return (value - timedelta(days=value.weekday())).isoformat()
+
+
+def clock(value: str) -> str:
+    '''
+    ``8:00`` -> ``08:00``, so times compare as strings
+    '''
+    (hours, minutes) = value.split(":")[:2]
+    return f"{int(hours):02d}:{minutes}"
+
+
+class ScheduleStore:
+    '''
+    SQLite store of lessons. Every lesson references subject,
+    type, auditory with building, its teachers and groups by id.
+    Weeks are ingested per source (teacher or group name), a week
+    with the same content as stored one is not touched
+    '''
+
+    def __init__(self, path: str = STORE_PATH) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS buildings (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS auditories (
+                id INTEGER PRIMARY KEY,
+                building_id INTEGER NOT NULL REFERENCES buildings (id),
+                name TEXT NOT NULL,
+                UNIQUE (building_id, name));
+            CREATE TABLE IF NOT EXISTS subjects (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS lesson_types (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS teachers (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS groups (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+            CREATE TABLE IF NOT EXISTS lessons (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL UNIQUE,
+                date TEXT NOT NULL,
+                week TEXT NOT NULL,
+                weekday INTEGER NOT NULL,
+                time_start TEXT NOT NULL,
+                time_end TEXT NOT NULL,
+                subject_id INTEGER NOT NULL REFERENCES subjects (id),
+                type_id INTEGER NOT NULL REFERENCES lesson_types (id),
+                auditory_id INTEGER REFERENCES auditories (id));
+            CREATE INDEX IF NOT EXISTS lessons_slot ON lessons (date, time_start);
+            CREATE INDEX IF NOT EXISTS lessons_auditory ON lessons (auditory_id, date);
+            CREATE INDEX IF NOT EXISTS lessons_week ON lessons (week);
+            CREATE TABLE IF NOT EXISTS lesson_teachers (
+                lesson_id INTEGER NOT NULL REFERENCES lessons (id) ON DELETE CASCADE,
+                teacher_id INTEGER NOT NULL REFERENCES teachers (id),
+                PRIMARY KEY (lesson_id, teacher_id));
+            CREATE INDEX IF NOT EXISTS lesson_teachers_teacher ON lesson_teachers (teacher_id);
+            CREATE TABLE IF NOT EXISTS lesson_groups (
+                lesson_id INTEGER NOT NULL REFERENCES lessons (id) ON DELETE CASCADE,
+                group_id INTEGER NOT NULL REFERENCES groups (id),
+                PRIMARY KEY (lesson_id, group_id));
+            CREATE INDEX IF NOT EXISTS lesson_groups_group ON lesson_groups (group_id);
+            CREATE TABLE IF NOT EXISTS weeks (
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                week TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                fetched REAL NOT NULL,
+                PRIMARY KEY (kind, name, week));
+            CREATE TABLE IF NOT EXISTS week_lessons (
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                week TEXT NOT NULL,
+                lesson_id INTEGER NOT NULL REFERENCES lessons (id) ON DELETE CASCADE,
+                PRIMARY KEY (kind, name, week, lesson_id));
+            CREATE INDEX IF NOT EXISTS week_lessons_lesson ON week_lessons (lesson_id);
+        ''')
+        # Names of small tables are kept in memory, they repeat in every lesson
+        self._ids = dict()
+
+    def _id(self, table: str, name: str) -> int:
+        key = (table, name)
+        found = self._ids.get(key)
+        if found is None:
+            self._db.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+            (found,) = self._db.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()
+            self._ids[key] = found
+        return found
+
+    def _auditory_id(self, lesson: dict) -> int | None:
+        if not lesson.get('auditories'):
+            return None
+        auditory = lesson['auditories'][0]
+        building_id = self._id("buildings", auditory['building']['name'])
+        key = ("auditories", building_id, auditory['name'])
+        found = self._ids.get(key)
+        if found is None:
+            self._db.execute("INSERT OR IGNORE INTO auditories (building_id, name) VALUES (?, ?)",
+                             (building_id, auditory['name']))
+            (found,) = self._db.execute("SELECT id FROM auditories WHERE building_id = ? AND name = ?",
+                                        (building_id, auditory['name'])).fetchone()
+            self._ids[key] = found
+        return found
+
+    def _add_lesson(self, day: dict, lesson: dict, relinked: set) -> int:
+        auditory_id = self._auditory_id(lesson)
+        teacher_ids = sorted({self._id("teachers", teacher['full_name'])
+                              for teacher in lesson.get('teachers') or ()})
+        group_ids = sorted({self._id("groups", group['name']) for group in lesson.get('groups') or ()})
+        row = (day['date'], clock(lesson['time_start']), clock(lesson['time_end']),
+               self._id("subjects", lesson['subject']), self._id("lesson_types", lesson['typeObj']['name']),
+               auditory_id)
+        # Teachers and groups tell apart lessons of one slot without a room
+        key = "|".join(map(str, (*row, ",".join(map(str, teacher_ids)), ",".join(map(str, group_ids)))))
+        self._db.execute('''INSERT OR IGNORE INTO lessons
+            (key, date, week, weekday, time_start, time_end, subject_id, type_id, auditory_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', (key, row[0], week_of(row[0]), day['weekday'], *row[1:]))
+        (lesson_id,) = self._db.execute("SELECT id FROM lessons WHERE key = ?", (key,)).fetchone()
+        # Links come from the new data only, once per lesson of the ingested week
+        if lesson_id not in relinked:
+            relinked.add(lesson_id)
+            self._db.execute("DELETE FROM lesson_teachers WHERE lesson_id = ?", (lesson_id,))
+            self._db.execute("DELETE FROM lesson_groups WHERE lesson_id = ?", (lesson_id,))
+        for teacher_id in teacher_ids:
+            self._db.execute("INSERT OR IGNORE INTO lesson_teachers VALUES (?, ?)", (lesson_id, teacher_id))
+        for group_id in group_ids:
+            self._db.execute("INSERT OR IGNORE INTO lesson_groups VALUES (?, ?)", (lesson_id, group_id))
+        return lesson_id
+
+    def ingest_week(self, kind: str, name: str, days: list, week: str = None) -> bool:
+        '''
+        Replace the week of ``kind`` (teacher or group) ``name`` by raw
+        ``days``. Returns False if the week did not change since last time
+        '''
+        if week is None:
+            if not days:
+                return False
+            week = week_of(days[0]['date'])
+        digest = hashlib.sha256(json.dumps(days, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+        with self._lock:
+            row = self._db.execute("SELECT hash FROM weeks WHERE kind = ? AND name = ? AND week = ?",
+                                   (kind, name, week)).fetchone()
+            if row is not None and row[0] == digest:
+                self._db.execute("UPDATE weeks SET fetched = ? WHERE kind = ? AND name = ? AND week = ?",
+                                 (time.time(), kind, name, week))
+                return False
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("DELETE FROM week_lessons WHERE kind = ? AND name = ? AND week = ?",
+                                 (kind, name, week))
+                relinked = set()
+                for day in days:
+                    for lesson in day['lessons']:
+                        self._db.execute("INSERT OR IGNORE INTO week_lessons VALUES (?, ?, ?, ?)",
+                                         (kind, name, week, self._add_lesson(day, lesson, relinked)))
+                # Lessons no source has any more
+                self._db.execute('''DELETE FROM lessons WHERE week = ? AND id NOT IN (
+                    SELECT lesson_id FROM week_lessons WHERE week = ?)''', (week, week))
+                self._db.execute("INSERT OR REPLACE INTO weeks VALUES (?, ?, ?, ?, ?)",
+                                 (kind, name, week, digest, time.time()))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                # Ids of rolled back rows could be remembered
+                self._ids.clear()
+                raise
+        return True
+
+    def free_auditories(self, building: str, day: str, start: str, end: str = None) -> list:
+        '''
+        Auditories of the building without lessons on ``day`` between
+        ``start`` and ``end`` (a pair of 1.5 hours by default)
+        '''
+        start = clock(start)
+        if end is None:
+            (hours, minutes) = map(int, start.split(":"))
+            end = f"{hours + (minutes + 90) // 60:02d}:{(minutes + 90) % 60:02d}"
+        with self._lock:
+            rows = self._db.execute('''
+                SELECT auditories.name FROM auditories
+                JOIN buildings ON buildings.id = auditories.building_id
+                WHERE buildings.name = ? AND auditories.id NOT IN (
+                    SELECT auditory_id FROM lessons
+                    WHERE date = ? AND time_start < ? AND time_end > ? AND auditory_id IS NOT NULL)
+                ORDER BY auditories.name''', (building, day, clock(end), start)).fetchall()
+        return [name for (name,) in rows]
+
+    def teacher_conflicts(self, first: str = None, last: str = None) -> list:
+        '''
+        Teachers with overlapping lessons: ``(teacher, date, (start, end, subject, auditory) x 2)``
+        '''
+        with self._lock:
+            return self._db.execute('''
+                SELECT teachers.name, a.date,
+                       a.time_start, a.time_end, sa.name, aa.name,
+                       b.time_start, b.time_end, sb.name, ab.name
+                FROM lesson_teachers AS ta
+                JOIN lesson_teachers AS tb ON tb.teacher_id = ta.teacher_id AND tb.lesson_id > ta.lesson_id
+                JOIN lessons AS a ON a.id = ta.lesson_id
+                JOIN lessons AS b ON b.id = tb.lesson_id
+                JOIN teachers ON teachers.id = ta.teacher_id
+                JOIN subjects AS sa ON sa.id = a.subject_id
+                JOIN subjects AS sb ON sb.id = b.subject_id
+                LEFT JOIN auditories AS aa ON aa.id = a.auditory_id
+                LEFT JOIN auditories AS ab ON ab.id = b.auditory_id
+                WHERE a.date = b.date AND a.time_start < b.time_end AND b.time_start < a.time_end
+                  AND a.date >= ? AND a.date <= ?
+                ORDER BY a.date, teachers.name''', (first or "", last or "9999")).fetchall()
+
+    def weekly_load(self, group: str = None) -> list:
+        '''
+        ``(group, week, lessons, hours)`` for every group or one group
+        '''
+        query = '''
+            SELECT groups.name, lessons.week, COUNT(*),
+                   SUM((strftime('%s', '2000-01-01 ' || time_end) -
+                        strftime('%s', '2000-01-01 ' || time_start)) / 3600.0)
+            FROM lesson_groups
+            JOIN groups ON groups.id = lesson_groups.group_id
+            JOIN lessons ON lessons.id = lesson_groups.lesson_id'''
+        parameters = ()
+        if group is not None:
+            query += " WHERE groups.name = ?"
+            parameters = (group,)
+        query += " GROUP BY groups.name, lessons.week ORDER BY groups.name, lessons.week"
+        with self._lock:
+            return self._db.execute(query, parameters).fetchall()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {table: self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ("lessons", "weeks", "auditories", "teachers", "groups")}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def main():
+    parser = ap.ArgumentParser(prog="ScheduleStore",
+                               description="Queries over stored schedules, fill it with scheduler.py -b --store")
+    parser.add_argument("--store", type=str, default=STORE_PATH, help="Store path")
+    commands = parser.add_subparsers(dest="command", required=True)
+    free = commands.add_parser("free", help="Free auditories in the building at the slot")
+    free.add_argument("building", type=str)
+    free.add_argument("date", type=str, help="yyyy-mm-dd")
+    free.add_argument("start", type=str, help="hh:mm")
+    free.add_argument("end", type=str, nargs="?", help="hh:mm, pair of 1.5 hours by default")
+    conflicts = commands.add_parser("conflicts", help="Teacher double-bookings")
+    conflicts.add_argument("--from", dest="first", type=str, help="yyyy-mm-dd")
+    conflicts.add_argument("--to", dest="last", type=str, help="yyyy-mm-dd")
+    load = commands.add_parser("load", help="Weekly load of groups")
+    load.add_argument("--group", type=str)
+    commands.add_parser("stats", help="Number of stored rows")
+    args = parser.parse_args()
+
+    store = ScheduleStore(args.store)
+    match args.command:
+        case "free":
+            for name in store.free_auditories(args.building, args.date, args.start, args.end):
+                print(name)
+        case "conflicts":
+            for (teacher, day, *lessons) in store.teacher_conflicts(args.first, args.last):
+                print(f"{day} {teacher}:")
+                print(f"    {lessons[0]} - {lessons[1]} {lessons[2]}, {lessons[3]}")
+                print(f"    {lessons[4]} - {lessons[5]} {lessons[6]}, {lessons[7]}")
+        case "load":
+            for (group, week, lessons, hours) in store.weekly_load(args.group):
+                print(f"{group:20} {week}  {lessons:3} lessons  {hours:5.1f} h")
+        case "stats":
+            print(store.get_stats())
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
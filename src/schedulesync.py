@@ -0,0 +1,224 @@
+import argparse as ap
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+from pagecache import PageCache
+from schedulestore import clock, week_of
+from scheduler import (BASE_URL, CACHE_PATH, CACHE_SIZE, MODES, POOL_SIZE, BatchSchedule,
+                       create_session, read_entries, week_dates)
+
+'''
+Incremental schedule sync: fetches are compared with the last seen
+state and only added, removed and modified lessons are emitted
+'''
+SYNC_PATH = "cache/sync.sqlite3"
+
+
+def fingerprint(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def lesson_identity(lesson: dict) -> str:
+    '''
+    Lesson is the same while its start, subject and type are; anything
+    else changed makes it modified, not removed and added
+    '''
+    return f"{clock(lesson['time_start'])}|{lesson['subject']}|{lesson['typeObj']['name']}"
+
+
+class ScheduleSync:
+    '''
+    Last seen fingerprints of every week, day and lesson of each
+    teacher, group or place. ``apply`` compares a new fetch with them
+    top down: equal week hash skips the week, equal day hash skips the day
+    '''
+
+    def __init__(self, path: str = SYNC_PATH) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS sync_weeks (
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                week TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (kind, name, week));
+            CREATE TABLE IF NOT EXISTS sync_days (
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                date TEXT NOT NULL,
+                week TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (kind, name, date));
+            CREATE INDEX IF NOT EXISTS sync_days_week ON sync_days (kind, name, week);
+            CREATE TABLE IF NOT EXISTS sync_lessons (
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                date TEXT NOT NULL,
+                identity TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                lesson TEXT NOT NULL,
+                PRIMARY KEY (kind, name, date, identity));
+        ''')
+        self.stats = {
+            "weeks_skipped": 0,
+            "days_skipped": 0,
+            "added": 0,
+            "removed": 0,
+            "modified": 0
+        }
+
+    @staticmethod
+    def _lessons(lessons: list) -> dict:
+        found = dict()
+        for lesson in lessons:
+            identity = lesson_identity(lesson)
+            # Subgroups have the same lesson at the same time in different rooms
+            number = 1
+            while f"{identity}#{number}" in found:
+                number += 1
+            found[f"{identity}#{number}"] = lesson
+        return found
+
+    def _event(self, event: str, kind: str, name: str, date: str, lesson: dict, previous: dict = None) -> dict:
+        self.stats[event] += 1
+        result = {
+            "event": event,
+            "kind": kind,
+            "name": name,
+            "date": date,
+            "time_start": lesson['time_start'],
+            "time_end": lesson['time_end'],
+            "subject": lesson['subject'],
+            "lesson": lesson
+        }
+        if previous is not None:
+            result["previous"] = previous
+        return result
+
+    def _diff_day(self, kind: str, name: str, date: str, lessons: list) -> list:
+        stored = {identity: (digest, json.loads(lesson)) for (identity, digest, lesson) in self._db.execute(
+            "SELECT identity, hash, lesson FROM sync_lessons WHERE kind = ? AND name = ? AND date = ?",
+            (kind, name, date))}
+        current = self._lessons(lessons)
+        events = list()
+        for (identity, lesson) in current.items():
+            digest = fingerprint(lesson)
+            if identity not in stored:
+                events.append(self._event("added", kind, name, date, lesson))
+            elif stored[identity][0] != digest:
+                events.append(self._event("modified", kind, name, date, lesson, stored[identity][1]))
+            else:
+                continue
+            self._db.execute("INSERT OR REPLACE INTO sync_lessons VALUES (?, ?, ?, ?, ?, ?)",
+                             (kind, name, date, identity, digest, json.dumps(lesson, ensure_ascii=False)))
+        for (identity, (digest, lesson)) in stored.items():
+            if identity not in current:
+                events.append(self._event("removed", kind, name, date, lesson))
+                self._db.execute("DELETE FROM sync_lessons WHERE kind = ? AND name = ? AND date = ? AND identity = ?",
+                                 (kind, name, date, identity))
+        return events
+
+    def apply(self, kind: str, name: str, week: str, days: list) -> list:
+        '''
+        Compare fetched ``days`` of the week (Monday, yyyy-mm-dd) with
+        the last seen ones, remember them and return change events
+        '''
+        week_hash = fingerprint(days)
+        with self._lock:
+            row = self._db.execute("SELECT hash FROM sync_weeks WHERE kind = ? AND name = ? AND week = ?",
+                                   (kind, name, week)).fetchone()
+            if row is not None and row[0] == week_hash:
+                self.stats["weeks_skipped"] += 1
+                return []
+            stored = dict(self._db.execute("SELECT date, hash FROM sync_days WHERE kind = ? AND name = ? AND week = ?",
+                                           (kind, name, week)))
+            events = list()
+            self._db.execute("BEGIN")
+            try:
+                for day in days:
+                    day_hash = fingerprint(day['lessons'])
+                    if stored.pop(day['date'], None) == day_hash:
+                        self.stats["days_skipped"] += 1
+                        continue
+                    events.extend(self._diff_day(kind, name, day['date'], day['lessons']))
+                    self._db.execute("INSERT OR REPLACE INTO sync_days VALUES (?, ?, ?, ?, ?)",
+                                     (kind, name, day['date'], week, day_hash))
+                # Days that disappeared from the week
+                for date in stored:
+                    events.extend(self._diff_day(kind, name, date, []))
+                    self._db.execute("DELETE FROM sync_days WHERE kind = ? AND name = ? AND date = ?",
+                                     (kind, name, date))
+                self._db.execute("INSERT OR REPLACE INTO sync_weeks VALUES (?, ?, ?, ?)",
+                                 (kind, name, week, week_hash))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return events
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def main():
+    parser = ap.ArgumentParser(prog="ScheduleSync",
+                               description="Poll schedules and print added, removed and modified lessons as JSON Lines")
+    parser.add_argument("-m", type=int, choices=MODES, required=True,
+                        help="Default kind of names: 1 - teacher, 2 - group, 3 - place")
+    parser.add_argument("-b", type=str, required=True, metavar="FILE",
+                        help="Names from file or - for stdin, 'teacher:', 'group:' or 'place:' prefix overrides -m")
+    parser.add_argument("-d", type=str, required=True, help="First date of the range")
+    parser.add_argument("--to", type=str, help="Last date of the range")
+    parser.add_argument("--interval", type=float, default=600, help="Seconds between polls")
+    parser.add_argument("--once", action="store_true", help="Poll once and exit")
+    parser.add_argument("--state", type=str, default=SYNC_PATH, help="Last seen state path")
+    parser.add_argument("--url", type=str, default=BASE_URL, help="Schedule site, e.g. local stub server")
+    parser.add_argument("--workers", type=int, default=POOL_SIZE, help="Concurrent requests")
+    parser.add_argument("--no-cache", action="store_true", help="Do not revalidate through cache of pages")
+    args = parser.parse_args()
+
+    entries = read_entries(args.b, MODES[args.m])
+    sync = ScheduleSync(args.state)
+    session = create_session(args.workers)
+    # Cached pages are revalidated on every poll, unchanged ones cost a 304
+    cache = None if args.no_cache else PageCache(CACHE_PATH, CACHE_SIZE)
+
+    def write(kind: str, name: str, date: str, days: list, error: BaseException) -> None:
+        if error is not None:
+            print(f"{kind} {name}, {date}: {error}", file=sys.stderr)
+            return
+        week = week_of(datetime.strptime(date, "%d.%m.%Y").date().isoformat())
+        for event in sync.apply(kind, name, week, days):
+            sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    while True:
+        start = time.perf_counter()
+        batch = BatchSchedule(entries, week_dates(args.d, args.to), workers=args.workers, session=session,
+                              base_url=args.url, cache=cache, refresh=True)
+        batch.run(write)
+        print(f"Poll in {time.perf_counter() - start:.2f} s: {sync.get_stats()}", file=sys.stderr)
+        if args.once:
+            break
+        time.sleep(args.interval)
+    sync.close()
+
+
+if __name__ == "__main__":
+    main()
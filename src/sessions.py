@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+from userstore import UserStore
+
+
+class SessionCache:
+    '''
+    In-memory LRU cache of logged in users with idle timeout.
+    Holds at most ``capacity`` sessions, the least recently used
+    one is evicted first. With ``store`` every login and logout is
+    written through to the user's database, so sessions survive restarts.
+    Activity is written there too, at most once in ``touch_interval``
+    seconds per user, so idle timeout of evicted or restored sessions
+    counts from the last activity, not from login
+    '''
+
+    def __init__(self, store: UserStore = None, capacity: int = 100_000,
+                 idle_timeout: float = 3600, touch_interval: float = 60) -> None:
+        self.store = store
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.touch_interval = touch_interval
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
+
+    def _expire(self, now: float) -> None:
+        # Sessions are ordered by last access, so expired ones are in front
+        while self._sessions:
+            (user_id, (last_seen, stored)) = next(iter(self._sessions.items()))
+            if now - last_seen <= self.idle_timeout:
+                break
+            self._sessions.popitem(last=False)
+            self.stats["expirations"] += 1
+
+    def _put(self, user_id: int, now: float, stored: float) -> None:
+        # ``stored`` is the activity time last written to the store
+        self._sessions[user_id] = (now, stored)
+        self._sessions.move_to_end(user_id)
+        self._expire(now)
+        while len(self._sessions) > self.capacity:
+            self._sessions.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def check(self, user_id: int) -> bool:
+        '''
+        Is the user logged in. Refreshes his idle timer
+        '''
+        now = time.time()
+        touch = False
+        with self._lock:
+            (last_seen, stored) = self._sessions.get(user_id, (None, None))
+            alive = last_seen is not None and now - last_seen <= self.idle_timeout
+            if alive:
+                self.stats["hits"] += 1
+                touch = self.store is not None and now - stored >= self.touch_interval
+                self._put(user_id, now, now if touch else stored)
+            else:
+                if last_seen is not None:
+                    del self._sessions[user_id]
+                    self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+        if touch:
+            self.store.touch(user_id, int(now))
+        if alive or self.store is None:
+            return alive
+        # Session from previous run or evicted one, idle since its last stored activity
+        user = self.store.get(user_id)
+        if not user or not user[1] or now - user[1] > self.idle_timeout:
+            return False
+        if not self.store.touch(user_id, int(now)):
+            return False
+        with self._lock:
+            self._put(user_id, now, now)
+        return True
+
+    def login(self, user_id: int) -> None:
+        now = time.time()
+        with self._lock:
+            self._put(user_id, now, now)
+        if self.store is not None:
+            self.store.set_logged_in(user_id, int(now))
+
+    def logout(self, user_id: int) -> None:
+        with self._lock:
+            self._sessions.pop(user_id, None)
+        if self.store is not None:
+            self.store.set_logged_in(user_id, 0)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def get_stats(self) -> dict:
+        '''
+        Hit, miss, eviction and expiration counters and current size
+        '''
+        with self._lock:
+            stats = dict(self.stats)
+            stats["sessions"] = len(self._sessions)
+        return stats
@@ -0,0 +1,110 @@
+import argparse as ap
+import builtins
+import importlib
+import os
+import sys
+import time
+
+'''
+Built-in startup profiler: import time of every module and
+process memory at named stages, like ``-X importtime`` but
+available in the running bot
+'''
+PROCESS_START = time.perf_counter()
+
+
+def current_rss() -> int | None:
+    '''
+    Resident memory of the process in bytes, None if unknown
+    '''
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return None
+
+
+class StartupReport:
+    '''
+    Collects stage marks and, after ``install``, cumulative
+    import time of modules that were not loaded before
+    '''
+
+    def __init__(self) -> None:
+        self.stages = list()
+        self.imports = dict()
+        self._original_import = None
+        self._depth = 0
+
+    def mark(self, stage: str) -> None:
+        self.stages.append((stage, time.perf_counter() - PROCESS_START, current_rss()))
+
+    def install(self) -> None:
+        if self._original_import is not None:
+            return
+        self._original_import = builtins.__import__
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level or name in sys.modules:
+                return self._original_import(name, globals, locals, fromlist, level)
+            self._depth += 1
+            start = time.perf_counter()
+            try:
+                return self._original_import(name, globals, locals, fromlist, level)
+            finally:
+                self._depth -= 1
+                # Top level imports only, nested ones are included in them
+                if self._depth == 0:
+                    self.imports[name] = self.imports.get(name, 0) + time.perf_counter() - start
+
+        builtins.__import__ = timed_import
+
+    def uninstall(self) -> None:
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def format(self, top: int = 15) -> str:
+        lines = ["Startup stages:"]
+        for (stage, elapsed, rss) in self.stages:
+            memory = f"{rss / 2**20:.1f} MB" if rss else "n/a"
+            lines.append(f"  {stage:24} {elapsed * 1000:9.1f} ms  rss {memory}")
+        if self.imports:
+            lines.append("Slowest imports:")
+            for (name, elapsed) in sorted(self.imports.items(), key=lambda item: -item[1])[:top]:
+                lines.append(f"  {name:24} {elapsed * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+
+REPORT = StartupReport()
+if os.environ.get('BOT_STARTUP_REPORT'):
+    REPORT.install()
+
+
+def main():
+    parser = ap.ArgumentParser(prog="StartupReport",
+                               description="Import modules and report import time and memory")
+    parser.add_argument("modules", nargs="+", help="Modules to import, e.g. bothandler")
+    parser.add_argument("--budget", type=float, help="Fail if import takes longer, seconds")
+    args = parser.parse_args()
+
+    REPORT.install()
+    REPORT.mark("interpreter")
+    for module in args.modules:
+        importlib.import_module(module)
+        REPORT.mark(f"import {module}")
+    REPORT.uninstall()
+    print(REPORT.format())
+    total = REPORT.stages[-1][1] - REPORT.stages[0][1]
+    if args.budget is not None and total > args.budget:
+        print(f"Import took {total:.3f} s, budget is {args.budget:.3f} s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse as ap
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+class UserStore:
+    '''
+    Persistent user database on SQLite in WAL mode.
+    Every user is one row ``(user_id, passwd_hash, logged_in)``
+    indexed by primary key, so lookups and writes do not depend
+    on the number of users. ``logged_in`` is the last activity
+    time of the logged in user, 0 when he is logged out
+    '''
+
+    def __init__(self, path: str, synchronous: str = "FULL") -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"PRAGMA synchronous={synchronous}")
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            passwd_hash TEXT NOT NULL,
+            logged_in INTEGER NOT NULL DEFAULT 0)''')
+
+    def get(self, user_id: int) -> tuple | None:
+        '''
+        ``(passwd_hash, logged_in)`` of the user or None
+        '''
+        with self._lock:
+            return self.connection.execute(
+                "SELECT passwd_hash, logged_in FROM users WHERE user_id = ?", (user_id,)).fetchone()
+
+    def add(self, user_id: int, passwd_hash: str) -> bool:
+        '''
+        Create user. False if he already exists
+        '''
+        with self._lock:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO users (user_id, passwd_hash) VALUES (?, ?)", (user_id, passwd_hash))
+        return cursor.rowcount == 1
+
+    def set_logged_in(self, user_id: int, logged_in: int) -> bool:
+        '''
+        Update login time (0 to logout). False if there is no such user
+        '''
+        with self._lock:
+            cursor = self.connection.execute(
+                "UPDATE users SET logged_in = ? WHERE user_id = ?", (logged_in, user_id))
+        return cursor.rowcount == 1
+
+    def touch(self, user_id: int, last_seen: int) -> bool:
+        '''
+        Update activity time of the logged in user. False if he is
+        logged out, so a late refresh never logs him in again
+        '''
+        with self._lock:
+            cursor = self.connection.execute(
+                "UPDATE users SET logged_in = ? WHERE user_id = ? AND logged_in != 0", (last_seen, user_id))
+        return cursor.rowcount == 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def import_legacy(self, path: str) -> int:
+        '''
+        Import old ``user_db`` file with concatenated JSON dumps.
+        The last dump is the most complete one. Returns imported count
+        '''
+        if not os.path.exists(path):
+            return 0
+        with open(path, "r") as f:
+            data = f.read()
+        decoder = json.JSONDecoder()
+        (database, position) = (dict(), 0)
+        while position < len(data):
+            try:
+                (database, position) = decoder.raw_decode(data, position)
+            except json.JSONDecodeError:
+                break
+        with self._lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO users (user_id, passwd_hash, logged_in) VALUES (?, ?, 0)",
+                [(int(user_id), value[0]) for (user_id, value) in database.items()])
+            self.connection.execute("COMMIT")
+        os.replace(path, path + ".imported")
+        return len(database)
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+def benchmark(users: int, synchronous: str) -> dict:
+    '''
+    Insert ``users`` one by one (one transaction each), then
+    measure reopen time, random lookups and login updates
+    '''
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "users.sqlite3")
+        store = UserStore(path, synchronous=synchronous)
+        start = time.perf_counter()
+        for user_id in range(users):
+            store.add(user_id, "0" * 64)
+        insert = users / (time.perf_counter() - start)
+        store.close()
+
+        start = time.perf_counter()
+        store = UserStore(path, synchronous=synchronous)
+        startup = time.perf_counter() - start
+
+        probes = 10000
+        start = time.perf_counter()
+        for index in range(probes):
+            store.get(index * 7919 % users)
+        lookup = probes / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for index in range(probes):
+            store.set_logged_in(index * 7919 % users, 1)
+        update = probes / (time.perf_counter() - start)
+        store.close()
+    return {"insert/s": insert, "startup s": startup, "lookup/s": lookup, "update/s": update}
+
+
+def main():
+    parser = ap.ArgumentParser(prog="UserStore", description="Benchmark bot user database")
+    parser.add_argument("--users", type=int, nargs="+", help="Database sizes",
+                        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--synchronous", type=str, help="SQLite synchronous mode",
+                        choices=["OFF", "NORMAL", "FULL"], default="FULL")
+    args = parser.parse_args()
+    for users in args.users:
+        result = benchmark(users, args.synchronous)
+        print(f"{users:>9} users: " + " ".join(f"{key}={value:.4g}" for (key, value) in result.items()))
+
+
+if __name__ == "__main__":
+    main()